@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+'''
+Tools for quickly plotting very large 2D arrays. Instead of drawing one
+polygon per cell (as `pcolor` does), arrays are first reduced to about the
+number of pixels available on screen and then drawn as a single image.
+'''
+
+import numpy as np
+
+
+def axes_pixels(ax):
+    '''
+    Return the number of whole display pixels covered by axes `ax` as
+    (nrows, ncols). Measure only after the figure layout (colorbars,
+    `tight_layout`, etc.) is final; see `fit_image`.
+    '''
+
+    bbox = ax.get_window_extent()
+
+    return max(int(bbox.height), 1), max(int(bbox.width), 1)
+
+
+def _bin_starts(n, m):
+    '''
+    Split `n` cells into `min(n, m)` nearly equal, contiguous bins and return
+    the index of the first cell of each bin.
+    '''
+
+    m = min(n, m)
+
+    return (np.arange(m) * n) // m
+
+
+def decimate(arr, shape, method='mean'):
+    '''
+    Reduce 2D array `arr` so that it is no bigger than `shape` by combining
+    blocks of neighboring cells. Blocks need not be the same size, so the
+    result is exactly `shape` in any direction where `arr` is bigger, rather
+    than being cut down by a whole integer factor. Arrays already smaller
+    than `shape` are returned unchanged.
+
+    Parameters
+    ----------
+    arr : Numpy array
+        The 2D array to reduce.
+    shape : tuple of ints
+        Maximum size (nrows, ncols) of the result.
+    method : str, defaults to 'mean'
+        How to combine each block of cells: 'mean', 'max', 'min', or
+        'minmax'. Use 'max' for categorical data (only existing values are
+        kept). 'minmax' keeps whichever of the block's minimum or maximum
+        lies farthest from the block mean, preserving peaks of either sign.
+
+    Returns
+    -------
+    reduced : Numpy array
+        The decimated array.
+    '''
+
+    arr = np.asarray(arr)
+    nrow, ncol = arr.shape
+
+    if method not in ('mean', 'max', 'min', 'minmax'):
+        raise ValueError(f'Unknown decimation method: {method}')
+    if nrow <= shape[0] and ncol <= shape[1]:
+        return arr
+
+    # Get the first cell of every block in each direction:
+    ri, ci = _bin_starts(nrow, shape[0]), _bin_starts(ncol, shape[1])
+
+    def reduce(ufunc):
+        return ufunc.reduceat(ufunc.reduceat(arr, ri, axis=0), ci, axis=1)
+
+    if method == 'max':
+        return reduce(np.maximum)
+    elif method == 'min':
+        return reduce(np.minimum)
+
+    # Block means; blocks differ in size so divide by each one's count.
+    counts = np.outer(np.diff(ri, append=nrow), np.diff(ci, append=ncol))
+    mean = reduce(np.add) / counts
+    if method == 'mean':
+        return mean
+
+    bmin, bmax = reduce(np.minimum), reduce(np.maximum)
+    return np.where(bmax - mean >= mean - bmin, bmax, bmin)
+
+
+def fast_image(ax, arr, extent, method='mean', **kwargs):
+    '''
+    Decimate `arr` to the pixel size of axes `ax` and draw it as an image.
+    Extra kwargs are handed to `imshow`. The color limits are taken from the
+    full array unless given.
+
+    Adding a colorbar or calling `tight_layout` afterwards shrinks the
+    axes, so call `fit_image` once the figure layout is final.
+
+    Parameters
+    ----------
+    ax : Matplotlib axes object
+        Axes to draw on.
+    arr : Numpy array
+        2D array to draw; the first index runs along the vertical axis.
+    extent : list of floats
+        Outer edges of the image: [left, right, bottom, top].
+    method : str, defaults to 'mean'
+        Decimation method; see `decimate`.
+
+    Returns
+    -------
+    image : Matplotlib AxesImage
+        The mappable image object.
+    '''
+
+    arr = np.asarray(arr)
+    reduced = decimate(arr, axes_pixels(ax), method=method)
+
+    if 'norm' not in kwargs:
+        kwargs.setdefault('vmin', arr.min())
+        kwargs.setdefault('vmax', arr.max())
+    kwargs.setdefault('interpolation', 'nearest')
+    image = ax.imshow(reduced, origin='lower', extent=extent, aspect='auto',
+                      **kwargs)
+
+    # Keep the full array so the image can be refit to a new axes size:
+    image.fullres = (arr, method)
+
+    return image
+
+
+def fit_image(image):
+    '''
+    Lay out and draw the figure holding `image` (made by `fast_image`), then
+    decimate the full array again to the final pixel size of its axes. The
+    image is then never bigger than the axes, so resampling it onto the
+    screen cannot drop rows or columns (e.g., a lone burning row).
+    Figures saved at a different `dpi` should be refit at that `dpi`.
+
+    Parameters
+    ----------
+    image : Matplotlib AxesImage
+        An image returned by `fast_image`.
+    '''
+
+    arr, method = image.fullres
+    image.axes.figure.canvas.draw()
+    image.set_data(decimate(arr, axes_pixels(image.axes), method=method))
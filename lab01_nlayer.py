@@ -9,21 +9,26 @@ TO REPRODUCE THE VALUES AND PLOTS IN MY REPORT, DO THIS:
 
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy.linalg import lu_factor, lu_solve
+
+from memo import memoize
+from opcache import OperatorCache
 
 # Physical Constants
 sigma = 5.67E-8  # Units: W/m2/K−4
 
-def n_layer_atmos(nlayers, epsilon=1, albedo=0.33, s0=1350, debug=False):
-    '''
-    docstring!
+# Cache of factorized coefficient matrices shared by all calls:
+nlayer_cache = OperatorCache(maxsize=16)
 
-    debug : bool, defaults to False
-        Turn on debug print outs.
+
+def _build_operators(nlayers, epsilon):
+    '''
+    Build and factorize the coefficient matrix for `n_layer_atmos`.
+    See `nlayer_operators` for parameters and return values.
     '''
 
     # Create array of coefficients, an N+1xN+1 array:
     A = np.zeros([nlayers+1, nlayers+1])
-    b = np.zeros(nlayers+1)
 
     # Populate based on our model:
     for i in range(nlayers+1):
@@ -32,15 +37,55 @@ def n_layer_atmos(nlayers, epsilon=1, albedo=0.33, s0=1350, debug=False):
                 A[i, j] = -2 + 1 * (j == 0)
             else:
                 A[i, j] = epsilon**(i>0) * (1-epsilon)**(np.abs(j - i) -1 )
+
+    return A, lu_factor(A)
+
+
+def nlayer_operators(nlayers, epsilon=1):
+    '''
+    Return the coefficient matrix for the N-layer problem and its LU
+    factorization. The matrix only depends on the number of layers and the
+    emissivity, so it is kept in `nlayer_cache` and reused when only albedo
+    or solar forcing change.
+
+    Parameters
+    ----------
+    nlayers : int
+        Number of atmospheric layers.
+    epsilon : float, defaults to 1
+        Emissivity of each layer.
+
+    Returns
+    -------
+    A : Numpy array
+        Coefficient matrix, size N+1 x N+1.
+    lu_piv : tuple
+        LU factorization of `A` as returned by `scipy.linalg.lu_factor`.
+    '''
+
+    return nlayer_cache.get((nlayers, float(epsilon)),
+                            lambda: _build_operators(nlayers, epsilon))
+
+
+def n_layer_atmos(nlayers, epsilon=1, albedo=0.33, s0=1350, debug=False):
+    '''
+    docstring!
+
+    debug : bool, defaults to False
+        Turn on debug print outs.
+    '''
+
+    # Get (possibly cached) coefficient matrix and its factorization:
+    A, lu_piv = nlayer_operators(nlayers, epsilon)
     if debug:
         print(A)
 
+    # Create right-hand side; only the surface has a source term:
+    b = np.zeros(nlayers+1)
     b[0] = -0.25 * s0 * (1-albedo)
 
-    # Invert matrix:
-    Ainv = np.linalg.inv(A)
     # Get solution:
-    fluxes = np.matmul(Ainv, b)  # Note our use of matrix multiplication
+    fluxes = lu_solve(lu_piv, b)
 
     # Turn fluxes into temperatures.
     temps = (fluxes/sigma/epsilon)**(1/4)
@@ -49,6 +94,10 @@ def n_layer_atmos(nlayers, epsilon=1, albedo=0.33, s0=1350, debug=False):
     return temps
 
 
+# Disk-memoized version of our solver:
+cached_n_layer_atmos = memoize(n_layer_atmos)
+
+
 def time_logic():
     '''Try to answer the question about how slow "if" statements are...'''
 
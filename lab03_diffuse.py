@@ -4,9 +4,14 @@
 Tools and methods for completing Lab 3 which is the best lab.
 '''
 
+from time import perf_counter
+
 import numpy as np
 import matplotlib.pyplot as plt
 
+from fastplot import fast_image, fit_image
+from memo import memoize
+
 plt.style.use('fivethirtyeight')
 
 # Solution to problem 10.3 from fink/matthews
@@ -24,8 +29,17 @@ sol10p3 = [[0.000000, 0.640000, 0.960000, 0.960000, 0.640000, 0.000000],
 sol10p3 = np.array(sol10p3).transpose()
 
 
+def init_parabola(x):
+    '''
+    Default initial condition for `solve_heat`: a parabola that is zero at
+    x=0 and x=1 and peaks at 1 in the middle.
+    '''
+
+    return 4*x - 4*x**2
+
+
 def solve_heat(xstop=1, tstop=0.2, dx=0.2, dt=0.02, c2=1, lowerbound=0,
-               upperbound=0):
+               upperbound=0, dtype=np.float64, initial=init_parabola):
     '''
     A function for solving the heat equation.
     Apply Neumann boundary conditions such that dU/dx = 0.
@@ -37,8 +51,8 @@ def solve_heat(xstop=1, tstop=0.2, dx=0.2, dt=0.02, c2=1, lowerbound=0,
         c^2, the square of the diffusion coefficient.
     Parameters
     ----------
-    initial : func
-        A function of position; sets the intial conditions at t=`trange[0]`
+    initial : func, defaults to `init_parabola`
+        A function of position; sets the intial conditions at t=0.
         Must accept an array of positions and return temperature at those
         positions as an equally sized array.
     upperbound, lowerbound : None, scalar, or func
@@ -48,6 +62,9 @@ def solve_heat(xstop=1, tstop=0.2, dx=0.2, dt=0.02, c2=1, lowerbound=0,
         Otherwise, Dirichlet conditions are used and either a scalar constant
         is provided or a function should be provided that accepts time and
         returns a value.
+    dtype : Numpy dtype, defaults to np.float64
+        Floating point precision of the solution. Use np.float32 to halve
+        memory use and traffic on big grids; see `check_heat_precision`.
 
     Returns
     -------
@@ -71,11 +88,11 @@ def solve_heat(xstop=1, tstop=0.2, dx=0.2, dt=0.02, c2=1, lowerbound=0,
     x = np.linspace(0, xstop, M)
 
     # Create solution matrix; set initial conditions
-    U = np.zeros([M, N])
-    U[:, 0] = 4*x - 4*x**2
+    U = np.zeros([M, N], dtype=dtype)
+    U[:, 0] = initial(x)
 
-    # Get our "r" coeff:
-    r = c2 * (dt/dx**2)
+    # Get our "r" coeff (in the working precision):
+    r = U.dtype.type(c2 * (dt/dx**2))
 
     # Solve our equation!
     for j in range(N-1):
@@ -103,11 +120,143 @@ def solve_heat(xstop=1, tstop=0.2, dx=0.2, dt=0.02, c2=1, lowerbound=0,
     return t, x, U
 
 
-def plot_heatsolve(t, x, U, title=None, **kwargs):
+# Disk-memoized version of our solver:
+cached_solve_heat = memoize(solve_heat)
+
+
+def solve_heat_steady(xstop=1, dx=0.2, lowerbound=0, upperbound=0, tstop=0.2,
+                      dt=0.02, c2=1, initial=init_parabola):
+    '''
+    Solve directly for the long-time (equilibrium) solution of the heat
+    equation, i.e., the boundary value problem d2U/dx2 = 0, on the same grid
+    and with the same boundary options as `solve_heat`. The result is the
+    fixed point of the `solve_heat` scheme itself.
+
+    If at least one boundary is Dirichlet, the equilibrium does not depend
+    on the time step, diffusion coefficient, or initial condition. If both
+    boundaries are insulated (None), the boundary value problem only says
+    the answer is constant; which constant `solve_heat` settles to depends
+    on `initial`, and, because its copy-the-neighbor boundaries do not
+    exactly conserve heat, on `dt` and `c2` too. In that case the constant
+    is found from the quantity the discrete scheme does conserve.
+
+    Parameters
+    ----------
+    xstop : float, defaults to 1
+        Length of the domain.
+    dx : float, defaults to 0.2
+        Grid spacing.
+    upperbound, lowerbound : None, scalar, or func
+        Set the lower and upper boundary conditions. If either is set to
+        None, then Neumann boundary condtions are used (zero gradient).
+        Otherwise, Dirichlet conditions are used with the given constant or,
+        if a function is given, its value at time `tstop`.
+    tstop : float, defaults to 0.2
+        Time at which to evaluate boundary functions.
+    dt : float, defaults to 0.02
+        Time step of the matching `solve_heat` run. Only used if both
+        boundaries are insulated.
+    c2 : float, defaults to 1
+        c^2, the square of the diffusion coefficient. Only used if both
+        boundaries are insulated.
+    initial : func, defaults to `init_parabola`
+        Initial condition of the matching `solve_heat` run; a function of
+        position. Only used if both boundaries are insulated.
+
+    Returns
+    -------
+    x : 1D Numpy array
+        Space values.
+    U : 1D Numpy array
+        Equilibrium solution at each point in `x`.
+    residual : float
+        Largest absolute residual of the discretized equations.
+    niter : int
+        Number of iterations used (always 1; the solve is direct).
+    '''
+
+    from scipy.sparse import diags
+    from scipy.sparse.linalg import spsolve
+
+    M = int(xstop / dx) + 1
+    x = np.linspace(0, xstop, M)
+
+    # Both sides insulated: any constant is a fixed point. Build the
+    # one-step update matrix P of `solve_heat` and find the weights `w` it
+    # conserves (w @ P = w); the equilibrium keeps w @ U equal to its
+    # initial value.
+    if lowerbound is None and upperbound is None:
+        from scipy.linalg import null_space
+
+        r = c2 * (dt/dx**2)
+        P = np.zeros((M, M))
+        i = np.arange(1, M-1)
+        P[i, i], P[i, i-1], P[i, i+1] = 1 - 2*r, r, r
+        P[0, :], P[-1, :] = P[1, :], P[-2, :]
+
+        w = null_space((P - np.eye(M)).T)[:, 0]
+        U = np.zeros(M) + (w @ initial(x)) / w.sum()
+        residual = float(np.abs(P @ U - U).max())
+        return x, U, residual, 1
+
+    # Interior points: U[i-1] - 2U[i] + U[i+1] = 0
+    A = diags([np.ones(M-1), -2*np.ones(M), np.ones(M-1)], [-1, 0, 1],
+              format='lil')
+    b = np.zeros(M)
+
+    # Apply boundary conditions by replacing the first and last equations:
+    for row, nbr, bound in ((0, 1, lowerbound), (M-1, M-2, upperbound)):
+        A[row, :] = 0
+        A[row, row] = 1
+        if bound is None:  # Neumann
+            A[row, nbr] = -1
+        elif callable(bound):  # Dirichlet/function
+            b[row] = bound(tstop)
+        else:  # Dirichlet/constant
+            b[row] = bound
+
+    A = A.tocsr()
+    U = spsolve(A, b)
+    residual = float(np.abs(A @ U - b).max())
+
+    return x, U, residual, 1
+
+
+def check_heat_precision(dtype=np.float32, **kwargs):
+    '''
+    Run `solve_heat` in reduced precision and in double precision and
+    report the largest difference between the two. Extra kwargs are handed
+    to `solve_heat`; the defaults make for a small, quick grid.
+
+    Parameters
+    ----------
+    dtype : Numpy dtype, defaults to np.float32
+        The reduced precision to check.
+
+    Returns
+    -------
+    maxdev : float
+        Maximum absolute difference from the float64 solution.
+    '''
+
+    kwargs.setdefault('dx', 0.02)
+    kwargs.setdefault('dt', 0.0002)
+
+    t, x, U_ref = solve_heat(dtype=np.float64, **kwargs)
+    t, x, U = solve_heat(dtype=dtype, **kwargs)
+    maxdev = np.abs(U.astype(np.float64) - U_ref).max()
+
+    print(f'solve_heat in {np.dtype(dtype).name}: max deviation from '
+          f'float64 = {maxdev:.3e} (max |U| = {np.abs(U_ref).max():.3e})')
+
+    return maxdev
+
+
+def plot_heatsolve(t, x, U, title=None, fast=False, method='mean', **kwargs):
     '''
     Plot the 2D solution for the `solve_heat` function.
 
-    Extra kwargs handed to pcolor.
+    Extra kwargs handed to pcolor (or imshow if `fast` is set).
 
     Paramters
     ---------
@@ -117,6 +266,12 @@ def plot_heatsolve(t, x, U, title=None, **kwargs):
         The solution of the heat equation, size is nSpace x nTime
     title : str, default is None
         Set title of figure.
+    fast : bool, defaults to False
+        If True, reduce `U` to the pixel size of the axes and draw it as an
+        image instead of one polygon per cell. Time spent rendering is
+        printed to screen.
+    method : str, defaults to 'mean'
+        How to reduce `U` in fast mode: 'mean', 'min', 'max', or 'minmax'.
 
     Returns
     -------
@@ -136,7 +291,14 @@ def plot_heatsolve(t, x, U, title=None, **kwargs):
     fig, ax = plt.subplots(1, 1, figsize=(8, 6))
 
     # Add contour to our axes:
-    contour = ax.pcolor(t, x, U, **kwargs)
+    if fast:
+        start = perf_counter()
+        # Image edges are half a cell beyond the first/last points:
+        dt, dx = t[1] - t[0], x[1] - x[0]
+        extent = [t[0] - dt/2, t[-1] + dt/2, x[0] - dx/2, x[-1] + dx/2]
+        contour = fast_image(ax, U, extent, method=method, **kwargs)
+    else:
+        contour = ax.pcolor(t, x, U, **kwargs)
     cbar = plt.colorbar(contour)
 
     # Add labels to stuff!
@@ -147,4 +309,10 @@ def plot_heatsolve(t, x, U, title=None, **kwargs):
 
     fig.tight_layout()
 
-    return fig, ax, cbar
\ No newline at end of file
+    # Refit the image to the axes now that the layout is final:
+    if fast:
+        fit_image(contour)
+        fig.canvas.draw()
+        print(f'Rendering took {perf_counter()-start:.3f}s')
+
+    return fig, ax, cbar
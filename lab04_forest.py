@@ -5,11 +5,16 @@ A module for burning forests and making pestilence.
 What a happy coding time.
 '''
 
+from time import perf_counter
+
 import numpy as np
 from numpy.random import rand
 import matplotlib.pyplot as plt
 from matplotlib.colors import ListedColormap
 
+from fastplot import fast_image, fit_image
+from memo import memoize
+
 # Set plot style:
 plt.style.use('fivethirtyeight')
 
@@ -21,7 +26,8 @@ colors = ['tan', 'forestgreen', 'crimson']
 forest_cmap = ListedColormap(colors)
 
 
-def forest_fire(isize=3, jsize=3, nstep=4, pspread=1.0, pignite=0.0, pbare=0):
+def forest_fire(isize=3, jsize=3, nstep=4, pspread=1.0, pignite=0.0, pbare=0,
+                pad=False, seed=None):
     '''
     Create a forest fire.
 
@@ -40,17 +46,37 @@ def forest_fire(isize=3, jsize=3, nstep=4, pspread=1.0, pignite=0.0, pbare=0):
     pbare : float, defaults to 0.0
         Set the chance that a point starts the simulation on bare (or
         immune) from 0 to 1 (0% to 100%).
+    pad : bool, defaults to False
+        The simulation stops as soon as nothing is burning. By default, the
+        returned history is trimmed to the steps that were run. If True, the
+        history is padded to `nstep` frames by repeating the final state.
+    seed : int, defaults to None
+        If given, draw random numbers from a generator of our own seeded
+        with `seed` so that the run can be reproduced. The global Numpy
+        random state is left untouched. Otherwise, use the global state.
+
+    Returns
+    -------
+    forest : Numpy array
+        The forest state at each step, size nTime x isize x jsize.
+    kstop : int
+        The last step that was actually run.
     '''
 
-    # Creating a forest and making all spots have trees.
-    forest = np.zeros((nstep, isize, jsize)) + 2
+    # Get our random number source:
+    rng = np.random if seed is None else np.random.RandomState(seed)
+
+    # Creating a forest and making all spots have trees. Only the first
+    # frame is filled now; untouched frames cost no memory if we stop early.
+    forest = np.zeros((nstep, isize, jsize))
+    forest[0, :, :] = 2
 
     # Set initial conditions for BURNING/INFECTED and BARE/IMMUNE
     # Start with BURNING/INFECTED:
     if pignite > 0:  # Scatter fire randomly:
         loc_ignite = np.zeros((isize, jsize), dtype=bool)
         while loc_ignite.sum() == 0:
-            loc_ignite = rand(isize, jsize) <= pignite
+            loc_ignite = rng.rand(isize, jsize) <= pignite
         print(f"Starting with {loc_ignite.sum()} points on fire or infected.")
         forest[0, loc_ignite] = 3
     else:
@@ -58,11 +84,17 @@ def forest_fire(isize=3, jsize=3, nstep=4, pspread=1.0, pignite=0.0, pbare=0):
         forest[0, isize//2, jsize//2] = 3
 
     # Set bare land/immune people:
-    loc_bare = rand(isize, jsize) <= pbare
+    loc_bare = rng.rand(isize, jsize) <= pbare
     forest[0, loc_bare] = 1
 
     # Loop through time to advance our fire.
+    kstop = 0
     for k in range(nstep-1):
+        # Nothing left burning? We're done.
+        if not (forest[k, :, :] == 3).any():
+            break
+        kstop = k+1
+
         # Assume the next time step is the same as the current:
         forest[k+1, :, :] = forest[k, :, :]
         # Search every spot that is on fire and spread fire as needed.
@@ -73,7 +105,8 @@ def forest_fire(isize=3, jsize=3, nstep=4, pspread=1.0, pignite=0.0, pbare=0):
                     continue
                 # Ah! it burns. Spread fire in each direction.
                 # Spread "up" (i to i-1)
-                if (pspread > rand()) and (i > 0) and (forest[k, i-1, j] == 2):
+                if (pspread > rng.rand()) and (i > 0) and \
+                        (forest[k, i-1, j] == 2):
                     forest[k+1, i-1, j] = 3
                 # Spread "Down"
                 # Spread "East"
@@ -82,7 +115,350 @@ def forest_fire(isize=3, jsize=3, nstep=4, pspread=1.0, pignite=0.0, pbare=0):
                 # Change buring to burnt:
                 forest[k+1, i, j] = 1
 
-    return forest
+    # Pad with the final state or trim to the steps that were run:
+    if pad:
+        forest[kstop+1:, :, :] = forest[kstop, :, :]
+    else:
+        forest = forest[:kstop+1, :, :]
+
+    return forest, kstop
+
+
+# Disk-memoized version; only seeded runs are reproducible, so only they
+# are cached:
+cached_forest_fire = memoize(forest_fire,
+                             skip=lambda args: args['seed'] is None)
+
+
+def forest_fire_frontier(isize=3, jsize=3, nstep=4, pspread=1.0, pignite=0.0,
+                         pbare=0):
+    '''
+    Create a forest fire by only tracking the burning front.
+
+    Rather than visiting every point on the grid at every step, only the
+    coordinates of burning points are kept. Fire spreads up, down, east,
+    and west from those points, so the cost of each step scales with the
+    size of the front rather than the size of the forest. The simulation
+    stops as soon as nothing is left burning.
+
+    Because no history is stored, only the final state of the forest is
+    returned along with the number of burning points at each step.
+
+    Parameters
+    ----------
+    isize, jsize : int, defaults to 3
+        Set size of forest in x and y direction, respectively.
+    nstep : int, defaults to 4
+        Set maximum number of steps to advance solution.
+    pspread : float, defaults to 1.0
+        Set chance that fire can spread in any direction, from 0 to 1
+        (i.e., 0% to 100% chance of spread.)
+    pignite : float, defaults to 0.0
+        Set the chance that a point starts the simulation on fire (or infected)
+        from 0 to 1 (0% to 100%).
+    pbare : float, defaults to 0.0
+        Set the chance that a point starts the simulation on bare (or
+        immune) from 0 to 1 (0% to 100%).
+
+    Returns
+    -------
+    forest : Numpy array
+        The final state of the forest, size isize x jsize.
+    nburn : Numpy array
+        Number of burning points at each step that was run, starting with
+        the initial condition.
+    '''
+
+    # Creating a forest and making all spots have trees.
+    forest = np.zeros((isize, jsize), dtype=np.int8) + 2
+
+    # Set initial conditions for BURNING/INFECTED and BARE/IMMUNE
+    # Start with BURNING/INFECTED:
+    if pignite > 0:  # Scatter fire randomly:
+        loc_ignite = np.zeros((isize, jsize), dtype=bool)
+        while loc_ignite.sum() == 0:
+            loc_ignite = rand(isize, jsize) <= pignite
+        print(f"Starting with {loc_ignite.sum()} points on fire or infected.")
+        forest[loc_ignite] = 3
+    else:
+        # Set initial fire to center:
+        forest[isize//2, jsize//2] = 3
+
+    # Set bare land/immune people:
+    loc_bare = rand(isize, jsize) <= pbare
+    forest[loc_bare] = 1
+
+    # Get the burning front as a pair of index arrays:
+    ifront, jfront = np.nonzero(forest == 3)
+    nburn = [ifront.size]
+
+    # Loop through time to advance our fire.
+    for k in range(nstep-1):
+        # Nothing left burning? We're done.
+        if ifront.size == 0:
+            break
+
+        # Spread fire in each direction from every burning point.
+        inew, jnew = [], []
+        for di, dj in ((-1, 0), (1, 0), (0, 1), (0, -1)):
+            i, j = ifront + di, jfront + dj
+            # Stay on the grid:
+            loc = (i >= 0) & (i < isize) & (j >= 0) & (j < jsize)
+            i, j = i[loc], j[loc]
+            # Only forested points can catch:
+            loc = (forest[i, j] == 2) & (pspread > rand(i.size))
+            inew.append(i[loc])
+            jnew.append(j[loc])
+
+        # Change burning to burnt:
+        forest[ifront, jfront] = 1
+
+        # New front; points caught from more than one side appear once.
+        flat = np.unique(np.concatenate(inew) * jsize + np.concatenate(jnew))
+        ifront, jfront = np.divmod(flat, jsize)
+        forest[ifront, jfront] = 3
+        nburn.append(ifront.size)
+
+    return forest, np.array(nburn)
+
+
+# Shared grid buffers for `forest_fire_parallel` worker processes:
+_shared = {}
+
+
+def _attach_shared(names, shape):
+    '''
+    Pool initializer for `forest_fire_parallel`: attach to the pair of
+    shared memory forest buffers so every worker sees the same grid.
+    '''
+
+    from multiprocessing.shared_memory import SharedMemory
+
+    _shared['shm'] = [SharedMemory(name=name) for name in names]
+    _shared['bufs'] = [np.ndarray(shape, dtype=np.int8, buffer=shm.buf)
+                       for shm in _shared['shm']]
+
+
+def _tile_rng(seed, itile, k):
+    '''
+    Get the random number stream for tile `itile` at step `k`. Streams only
+    depend on the seed, the tile, and the step, so results do not change
+    with the number of worker processes.
+    '''
+
+    return np.random.default_rng(
+        np.random.SeedSequence(seed, spawn_key=(itile, k)))
+
+
+def _init_tile(args):
+    '''
+    Set the initial conditions for rows `r0` to `r1` of the shared forest.
+    Returns the number of burning points in the tile.
+    '''
+
+    itile, r0, r1, seed, pignite, pbare = args
+    forest = _shared['bufs'][0]
+    isize, jsize = forest.shape
+    rng = _tile_rng(seed, itile, 0)
+
+    tile = np.zeros((r1-r0, jsize), dtype=np.int8) + 2
+
+    # Start with BURNING/INFECTED:
+    if pignite > 0:  # Scatter fire randomly:
+        tile[rng.random(tile.shape) <= pignite] = 3
+    elif r0 <= isize//2 < r1:
+        # Set initial fire to center:
+        tile[isize//2 - r0, jsize//2] = 3
+
+    # Set bare land/immune people:
+    tile[rng.random(tile.shape) <= pbare] = 1
+
+    forest[r0:r1, :] = tile
+
+    return int((tile == 3).sum())
+
+
+def _step_tile(args):
+    '''
+    Advance rows `r0` to `r1` of the shared forest by one step, reading the
+    current state (including one halo row above and below the tile) from
+    buffer `src` and writing the new state to the other buffer.
+    Returns the number of burning points in the tile.
+    '''
+
+    itile, r0, r1, k, src, seed, pspread = args
+    now, nxt = _shared['bufs'][src], _shared['bufs'][1-src]
+    isize, jsize = now.shape
+    rng = _tile_rng(seed, itile, k+1)
+
+    # Get burning points in the tile plus halo rows, padded with
+    # non-burning points beyond the edge of the forest:
+    lo, hi = max(r0-1, 0), min(r1+1, isize)
+    burning = np.zeros((r1-r0+2, jsize+2), dtype=bool)
+    burning[lo-r0+1:hi-r0+1, 1:-1] = now[lo:hi, :] == 3
+
+    # Spread fire from each direction:
+    tile = now[r0:r1, :]
+    catch = np.zeros(tile.shape, dtype=bool)
+    for neighbor in (burning[:-2, 1:-1], burning[2:, 1:-1],
+                     burning[1:-1, :-2], burning[1:-1, 2:]):
+        catch |= neighbor & (rng.random(tile.shape) < pspread)
+
+    # Forested points catch; burning points burn out:
+    new = tile.copy()
+    new[(tile == 2) & catch] = 3
+    new[tile == 3] = 1
+    nxt[r0:r1, :] = new
+
+    return int((new == 3).sum())
+
+
+def forest_fire_parallel(isize=3, jsize=3, nstep=4, pspread=1.0, pignite=0.0,
+                         pbare=0, nproc=None, ntiles=None, seed=None):
+    '''
+    Create a forest fire on a very large grid using several processes.
+
+    The forest is split into tiles of whole rows. Two copies of the forest
+    (the current and next step) live in shared memory; each step, a pool of
+    worker processes advances every tile, reading one halo row from each of
+    its neighbors out of the current buffer. Every tile gets its own random
+    number stream derived from `seed`, so for a fixed seed and number of
+    tiles the result is the same no matter how many processes are used.
+    The simulation stops early once nothing is burning.
+
+    Unlike `forest_fire`, fire spreads in all four directions and initial
+    ignition is not redrawn if no points happen to catch.
+
+    Parameters
+    ----------
+    isize, jsize : int, defaults to 3
+        Set size of forest in x and y direction, respectively.
+    nstep : int, defaults to 4
+        Set maximum number of steps to advance solution.
+    pspread : float, defaults to 1.0
+        Set chance that fire can spread in any direction, from 0 to 1
+        (i.e., 0% to 100% chance of spread.)
+    pignite : float, defaults to 0.0
+        Set the chance that a point starts the simulation on fire (or infected)
+        from 0 to 1 (0% to 100%).
+    pbare : float, defaults to 0.0
+        Set the chance that a point starts the simulation on bare (or
+        immune) from 0 to 1 (0% to 100%).
+    nproc : int, defaults to None
+        Number of worker processes. Defaults to the number of CPUs.
+    ntiles : int, defaults to None
+        Number of row tiles. Defaults to four per worker process (but never
+        more than `isize`).
+    seed : int, defaults to None
+        Seed for the random number streams. If not given, a fresh seed is
+        drawn.
+
+    Returns
+    -------
+    forest : Numpy array
+        The final state of the forest, size isize x jsize.
+    nburn : Numpy array
+        Number of burning points at each step that was run, starting with
+        the initial condition.
+    '''
+
+    import os
+    from multiprocessing import Pool
+    from multiprocessing.shared_memory import SharedMemory
+
+    if nproc is None:
+        nproc = os.cpu_count()
+    if ntiles is None:
+        ntiles = 4 * nproc
+    ntiles = max(1, min(ntiles, isize))
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    # Split rows into tiles:
+    edges = np.linspace(0, isize, ntiles+1).astype(int)
+    tiles = [(itile, edges[itile], edges[itile+1]) for itile in range(ntiles)]
+
+    # Create our current/next forest buffers in shared memory:
+    shms = [SharedMemory(create=True, size=isize*jsize) for i in range(2)]
+    try:
+        names = [shm.name for shm in shms]
+        with Pool(nproc, initializer=_attach_shared,
+                  initargs=(names, (isize, jsize))) as pool:
+            counts = pool.map(_init_tile, [(itile, r0, r1, seed, pignite,
+                                            pbare)
+                                           for itile, r0, r1 in tiles])
+            nburn = [sum(counts)]
+
+            # Loop through time to advance our fire.
+            src = 0
+            for k in range(nstep-1):
+                if nburn[-1] == 0:
+                    break
+                counts = pool.map(_step_tile, [(itile, r0, r1, k, src, seed,
+                                                pspread)
+                                               for itile, r0, r1 in tiles])
+                nburn.append(sum(counts))
+                src = 1 - src
+
+        forest = np.ndarray((isize, jsize), dtype=np.int8,
+                            buffer=shms[src].buf).copy()
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    return forest, np.array(nburn)
+
+
+def bench_forest_parallel(isize=4000, jsize=4000, nstep=50, nprocs=None,
+                          **kwargs):
+    '''
+    Time `forest_fire_parallel` for a range of process counts and print the
+    speed up relative to a single process. Extra kwargs are handed to
+    `forest_fire_parallel`.
+
+    Parameters
+    ----------
+    isize, jsize : int, defaults to 4000
+        Set size of forest in x and y direction, respectively.
+    nstep : int, defaults to 50
+        Set number of steps to advance solution.
+    nprocs : list of ints, defaults to None
+        Process counts to try. Defaults to powers of two up to the number of
+        CPUs.
+
+    Returns
+    -------
+    nprocs : list of ints
+        The process counts that were timed.
+    times : Numpy array
+        Run time, in seconds, for each process count.
+    '''
+
+    import os
+    from time import perf_counter
+
+    if nprocs is None:
+        ncpu = os.cpu_count()
+        nprocs = [2**n for n in range(int(np.log2(ncpu))+1)]
+
+    # Burn lots of points so every step has real work to do:
+    kwargs.setdefault('pignite', 0.01)
+    kwargs.setdefault('pspread', 0.8)
+    kwargs.setdefault('seed', 410)
+
+    # Keep tile layout fixed so every run does the same work:
+    kwargs.setdefault('ntiles', 4*max(nprocs))
+
+    times = np.zeros(len(nprocs))
+    for i, nproc in enumerate(nprocs):
+        start = perf_counter()
+        forest_fire_parallel(isize, jsize, nstep, nproc=nproc, **kwargs)
+        times[i] = perf_counter() - start
+        print(f"{nproc:3d} processes: {times[i]:8.3f}s "
+              f"(speed up = {times[0]/times[i]:5.2f}x)")
+
+    return nprocs, times
 
 
 def plot_progression(forest):
@@ -106,10 +482,14 @@ def plot_progression(forest):
     plt.ylabel('Percent Total Forest')
 
 
-def plot_forest2d(forest_in, itime=0):
+def plot_forest2d(forest_in, itime=0, fast=False):
     '''
     Given a forest of size (ntime, nx, ny), plot the itime-th moment as a
     2d pcolor plot.
+
+    If `fast` is True, the forest is max-pooled down to the pixel size of the
+    axes (so burning points win over forested, and forested over bare) and
+    drawn as an image instead. Time spent rendering is printed to screen.
     '''
 
     # Create figure and axes
@@ -117,7 +497,14 @@ def plot_forest2d(forest_in, itime=0):
     fig.subplots_adjust(left=.117, right=.974, top=.929, bottom=0.03)
 
     # Add our pcolor plot, save the resulting mappable object.
-    map = ax.pcolor(forest_in[itime, :, :], vmin=1, vmax=3, cmap=forest_cmap)
+    if fast:
+        start = perf_counter()
+        nx, ny = forest_in.shape[1:]
+        map = fast_image(ax, forest_in[itime, :, :], [0, ny, 0, nx],
+                         method='max', vmin=1, vmax=3, cmap=forest_cmap)
+    else:
+        map = ax.pcolor(forest_in[itime, :, :], vmin=1, vmax=3,
+                        cmap=forest_cmap)
 
     # Add a colorbar by handing our mappable to the colorbar function.
     cbar = plt.colorbar(map, ax=ax, shrink=.8, fraction=.08,
@@ -132,6 +519,12 @@ def plot_forest2d(forest_in, itime=0):
     ax.set_ylabel('Northward ($km$) $\\longrightarrow$')
     ax.set_title(f'The Seven Acre Wood at T={itime:03d}')
 
+    # Refit the image to the axes now that the colorbar has shrunk them:
+    if fast:
+        fit_image(map)
+        fig.canvas.draw()
+        print(f'Rendering took {perf_counter()-start:.3f}s')
+
     # Return figure object to caller:
     return fig
 
@@ -7,6 +7,9 @@ Lab 5: Snowball Earth.
 import numpy as np
 import matplotlib.pyplot as plt
 
+from memo import memoize
+from opcache import OperatorCache
+
 plt.style.use('fivethirtyeight')
 
 # Some constants:
@@ -16,6 +19,10 @@ sigma = 5.67e-8      # Steffan-Boltzman constant
 C = 4.2e6            # Heat capacity of water
 rho = 1020           # Density of sea-water (kg/m^3)
 
+# Cache of prebuilt operators and insolation shared by all calls to
+# `snowball_stream`:
+snowball_cache = OperatorCache(maxsize=16)
+
 
 def gen_grid(npoints=18):
     '''
@@ -125,9 +132,323 @@ def insolation(S0, lats):
     return insolation
 
 
+def insolation_table(S0, lats, ndays=365):
+    '''
+    Given a solar constant (`S0`), calculate daily, longitude-averaged
+    insolation as a function of day of year and latitude. This is the
+    seasonally varying counterpart to `insolation`: it uses the same tilt
+    cycle and normalization, but keeps each day instead of averaging over
+    the year. Days where the sun never rises (negative insolation in the
+    annual average) are set to zero.
+
+    Parameters
+    ----------
+    S0 : float
+        Solar constant (1370 for typical Earth conditions.)
+    lats : Numpy array
+        Latitudes to output insolation, in degrees from the south pole.
+    ndays : int, defaults to 365
+        Number of days in one year.
+
+    Returns
+    -------
+    table : numpy array
+        Insolation in W/m^2, size nDays x nLat.
+    '''
+
+    # Constants:
+    max_tilt = 23.5   # tilt of earth in degrees
+
+    #  Daily rotation of earth reduces solar constant by distributing the sun
+    #  energy all along a zonal band
+    dlong = 0.01  # Use 1/100 of a degree in summing over latitudes
+    angle = np.cos(np.pi/180. * np.arange(0, 360, dlong))
+    angle[angle < 0] = 0
+    total_solar = S0 * angle.sum()
+    S0_avg = total_solar / (360/dlong)
+
+    # Spin axis tilt for every day in 1 year:
+    tilt = max_tilt * np.cos(2.0*np.pi*np.arange(ndays)/ndays)
+
+    # Solar zenith for every day and latitude; do not let it go past 180:
+    zen = lats[np.newaxis, :] - 90. + tilt[:, np.newaxis]
+    zen[zen > 90] = 90
+    cosz = np.cos(np.pi/180. * zen)
+    cosz[cosz < 0] = 0
+
+    # Same normalization as `insolation`:
+    table = S0_avg**2 * cosz / ndays
+
+    return table
+
+
+def _build_operators(nlat, dt, lam, dtype=np.float64):
+    '''
+    Build the grid and all matrix operators for the snowball Earth problem.
+    See `snowball_operators` for parameters and return values.
+    '''
+
+    # Set up grid:
+    dlat, lats = gen_grid(nlat)
+    # Y-spacing for cells in physical units:
+    dy = np.pi * radearth / nlat
+
+    # Create our first derivative operator.
+    B = np.zeros((nlat, nlat))
+    B[np.arange(nlat-1)+1, np.arange(nlat-1)] = -1
+    B[np.arange(nlat-1), np.arange(nlat-1)+1] = 1
+    B[0, :] = B[-1, :] = 0
+
+    # Create area array:
+    Axz = np.pi * ((radearth+50.0)**2 - radearth**2) * np.sin(np.pi/180.*lats)
+    # Get derivative of Area:
+    dAxz = np.matmul(B, Axz)
+
+    # Set timestep to seconds:
+    dt = dt * 365 * 24 * 3600
+
+    # Create our K matrix:
+    K = np.zeros((nlat, nlat))
+    K[np.arange(nlat), np.arange(nlat)] = -2
+    K[np.arange(nlat-1)+1, np.arange(nlat-1)] = 1
+    K[np.arange(nlat-1), np.arange(nlat-1)+1] = 1
+    # Boundary conditions:
+    K[0, 1], K[-1, -2] = 2, 2
+    # Units!
+    K *= 1/dy**2
+
+    # Create L matrix.
+    Linv = np.linalg.inv(np.eye(nlat) - dt * lam * K)
+
+    # Operators are built in double precision, then cast to working dtype:
+    B, Axz, dAxz, K, Linv = [x.astype(dtype) for x in (B, Axz, dAxz, K, Linv)]
+
+    return lats, dy, B, Axz, dAxz, K, Linv
+
+
+def snowball_operators(nlat=18, dt=1.0, lam=100., dtype=np.float64):
+    '''
+    Return the grid and matrix operators for the snowball Earth problem.
+    These depend only on the grid size, time step, and diffusivity, so they
+    are kept in `snowball_cache` and reused across calls.
+
+    Parameters
+    ----------
+    nlat : int, defaults to 18
+        Number of latitude cells.
+    dt : int or float, defaults to 1.0
+        Size of timestep in years.
+    lam : float, defaults to 100
+        Set ocean diffusivity
+    dtype : Numpy dtype, defaults to np.float64
+        Floating point precision of the operators.
+
+    Returns
+    -------
+    lats : Numpy array
+        Latitudes of cell centers in degrees.
+    dy : float
+        Cell spacing in meters.
+    B : Numpy array
+        First derivative operator (unitless), size nLat x nLat.
+    Axz, dAxz : Numpy arrays
+        Area of each latitude band and its derivative.
+    K : Numpy array
+        Second derivative operator in 1/m^2, size nLat x nLat.
+    Linv : Numpy array
+        Inverse of the implicit diffusion operator, size nLat x nLat.
+    '''
+
+    dtype = np.dtype(dtype)
+
+    return snowball_cache.get((nlat, float(dt), float(lam), dtype.str),
+                              lambda: _build_operators(nlat, dt, lam, dtype))
+
+
+def _insolation_forcing(solar, lats, nlat, dt_yr, dtype=np.float64,
+                        seasonal=False):
+    '''
+    Get the (possibly cached) insolation forcing for the snowball Earth
+    models as a table of days by latitudes. With `seasonal` set, the table
+    has one row per day of the year; time steps of a year or more only ever
+    see the annual mean, so they get a single averaged row instead. The
+    annual-mean forcing is a single row.
+
+    Parameters
+    ----------
+    solar : float
+        Solar constant in W/m2.
+    lats : Numpy array
+        Latitudes of the grid, in degrees from the south pole.
+    nlat : int
+        Number of latitudes; part of the cache key.
+    dt_yr : float
+        Time step in years.
+    dtype : Numpy dtype, defaults to np.float64
+        Floating point precision of the table.
+    seasonal : bool, defaults to False
+        Use seasonally varying insolation (see `insolation_table`).
+
+    Returns
+    -------
+    table : Numpy array
+        Insolation in W/m2, size nDays x nlat. Get the row for each step
+        with `_insolation_day`.
+    ndays : int
+        Number of rows in `table`.
+    '''
+
+    if seasonal:
+        table = snowball_cache.get(('insolation_table', float(solar), nlat),
+                                   lambda: insolation_table(solar, lats))
+        if dt_yr >= 1:
+            table = table.mean(axis=0, keepdims=True)
+    else:
+        table = snowball_cache.get(('insolation', float(solar), nlat),
+                                   lambda: insolation(solar, lats))
+        table = table[np.newaxis, :]
+    table = table.astype(dtype, copy=False)
+
+    return table, table.shape[0]
+
+
+def _insolation_day(istep, dt_yr, ndays):
+    '''
+    Return the row of an insolation table with `ndays` rows to use for step
+    `istep`: the day of year at the middle of the step.
+    '''
+
+    return int((((istep+.5) * dt_yr) % 1) * ndays) % ndays
+
+
+def snowball_stream(nlat=18, tfinal=10000, dt=1.0, lam=100., emiss=1.0,
+                    init_cond=temp_warm, apply_spherecorr=False, albice=.6,
+                    albgnd=.3, apply_insol=False, solar=1370, stride=1,
+                    dtype=np.float64, seasonal=False):
+    '''
+    Solve the snowball Earth problem, yielding the state of the solution
+    every `stride` time steps as the run proceeds. The initial condition is
+    always yielded first. No history is stored, so long runs can be
+    examined in a single pass with constant memory.
+
+    Parameters
+    ----------
+    nlat : int, defaults to 18
+        Number of latitude cells.
+    tfinal : int or float, defaults to 10,000
+        Time length of simulation in years.
+    dt : int or float, defaults to 1.0
+        Size of timestep in years.
+    lam : float, defaults to 100
+        Set ocean diffusivity
+    emiss : float, defaults to 1.0
+        Set emissivity of Earth/ground.
+    init_cond : function, float, or array
+        Set the initial condition of the simulation. If a function is given,
+        it must take latitudes as input and return temperature as a function
+        of lat. Otherwise, the given values are used as-is.
+    apply_spherecorr : bool, defaults to False
+        Apply spherical correction term
+    apply_insol : bool, defaults to False
+        Apply insolation term.
+    solar : float, defaults to 1370
+        Set level of solar forcing in W/m2
+    albice, albgnd : float, defaults to .6 and .3
+        Set albedo values for ice and ground.
+    stride : int, defaults to 1
+        Yield the solution every `stride` time steps.
+    dtype : Numpy dtype, defaults to np.float64
+        Floating point precision used throughout the solve; see
+        `check_snowball_precision`.
+    seasonal : bool, defaults to False
+        Use seasonally varying insolation (see `insolation_table`) rather
+        than the annual mean. Each step uses the day of year at the middle
+        of the step, so `dt` should be well under a year; for `dt` of a year
+        or more, the annual mean of the table is used.
+
+    Yields
+    ------
+    time : float
+        Simulation time in years.
+    Temp : Numpy array
+        Temperature as a function of latitude at `time`.
+    albedo : Numpy array
+        Albedo as a function of latitude at `time`.
+    '''
+
+    if stride < 1:
+        raise ValueError(f'stride must be a positive integer, got {stride}.')
+
+    # Get (possibly cached) grid and operators:
+    lats, dy, B, Axz, dAxz, K, Linv = snowball_operators(nlat, dt, lam,
+                                                         dtype)
+
+    # Set number of time steps:
+    nsteps = int(tfinal / dt)
+
+    # Keep time step in years for reporting:
+    dt_yr = dt
+
+    # Set timestep to seconds:
+    dt = dt * 365 * 24 * 3600
+
+    # Create (or reuse) insolation:
+    table, ndays = _insolation_forcing(solar, lats, nlat, dt_yr, dtype,
+                                       seasonal)
+    insol = table[0, :]
+
+    # Create temp array; set our initial condition
+    Temp = np.zeros(nlat, dtype=dtype)
+    if callable(init_cond):
+        Temp = np.array(init_cond(lats), dtype=dtype)
+    else:
+        Temp += init_cond
+
+    # Set initial albedo.
+    albedo = np.zeros(nlat, dtype=dtype)
+    loc_ice = Temp <= -10  # Sea water freezes at ten below.
+    albedo[loc_ice] = albice
+    albedo[~loc_ice] = albgnd
+
+    # Report initial condition. Copies are handed out because Temp is
+    # modified in place by the radiative term.
+    yield 0., Temp.copy(), albedo.copy()
+
+    # SOLVE!
+    for istep in range(nsteps):
+        # Update Albedo:
+        loc_ice = Temp <= -10  # Sea water freezes at ten below.
+        albedo[loc_ice] = albice
+        albedo[~loc_ice] = albgnd
+
+        # Create spherical coordinates correction term
+        if apply_spherecorr:
+            sphercorr = (lam*dt) / (4*Axz*dy**2) * np.matmul(B, Temp) * dAxz
+        else:
+            sphercorr = 0
+
+        # Apply radiative/insolation term:
+        if apply_insol:
+            if ndays > 1:
+                insol = table[_insolation_day(istep, dt_yr, ndays), :]
+            radiative = (1-albedo)*insol - emiss*sigma*(Temp+273)**4
+            Temp += dt * radiative / (rho*C*mxdlyr)
+
+        # Advance solution.
+        Temp = np.matmul(Linv, Temp + sphercorr)
+
+        # Report solution on output steps:
+        if (istep+1) % stride == 0:
+            loc_ice = Temp <= -10
+            albedo[loc_ice] = albice
+            albedo[~loc_ice] = albgnd
+            yield (istep+1) * dt_yr, Temp.copy(), albedo.copy()
+
+
 def snowball_earth(nlat=18, tfinal=10000, dt=1.0, lam=100., emiss=1.0,
                    init_cond=temp_warm, apply_spherecorr=False, albice=.6,
-                   albgnd=.3, apply_insol=False, solar=1370):
+                   albgnd=.3, apply_insol=False, solar=1370,
+                   dtype=np.float64, seasonal=False):
     '''
     Solve the snowball Earth problem.
 
@@ -155,6 +476,10 @@ def snowball_earth(nlat=18, tfinal=10000, dt=1.0, lam=100., emiss=1.0,
         Set level of solar forcing in W/m2
     albice, albgnd : float, defaults to .6 and .3
         Set albedo values for ice and ground.
+    dtype : Numpy dtype, defaults to np.float64
+        Floating point precision used throughout the solve.
+    seasonal : bool, defaults to False
+        Use seasonally varying insolation; see `snowball_stream`.
 
     Returns
     --------
@@ -165,95 +490,529 @@ def snowball_earth(nlat=18, tfinal=10000, dt=1.0, lam=100., emiss=1.0,
         Temperature as a function of latitude.
     '''
 
-    # Set up grid:
     dlat, lats = gen_grid(nlat)
-    # Y-spacing for cells in physical units:
-    dy = np.pi * radearth / nlat
 
-    # Create our first derivative operator.
-    B = np.zeros((nlat, nlat))
-    B[np.arange(nlat-1)+1, np.arange(nlat-1)] = -1
-    B[np.arange(nlat-1), np.arange(nlat-1)+1] = 1
-    B[0, :] = B[-1, :] = 0
+    # Only the final state is needed, so only output the last step:
+    nsteps = int(tfinal / dt)
+    for time, Temp, albedo in snowball_stream(
+            nlat=nlat, tfinal=tfinal, dt=dt, lam=lam, emiss=emiss,
+            init_cond=init_cond, apply_spherecorr=apply_spherecorr,
+            albice=albice, albgnd=albgnd, apply_insol=apply_insol,
+            solar=solar, stride=max(nsteps, 1), dtype=dtype,
+            seasonal=seasonal):
+        pass
 
-    # Create area array:
-    Axz = np.pi * ((radearth+50.0)**2 - radearth**2) * np.sin(np.pi/180.*lats)
-    # Get derivative of Area:
-    dAxz = np.matmul(B, Axz)
+    return lats, Temp
+
+
+# Disk-memoized version of our solver:
+cached_snowball_earth = memoize(snowball_earth)
+
+
+def snowball_history(stride=1, **kwargs):
+    '''
+    Run the snowball Earth problem and collect the solution every `stride`
+    time steps into compact arrays. Extra kwargs are handed to
+    `snowball_stream`.
+
+    Parameters
+    ----------
+    stride : int, defaults to 1
+        Save the solution every `stride` time steps.
+
+    Returns
+    -------
+    lats : Numpy array
+        Latitudes representing cell centers in degrees.
+    times : Numpy array
+        Time of each output in years, size is nOut.
+    Temp : Numpy array
+        Temperature history, size is nOut x nLat.
+    albedo : Numpy array
+        Albedo history, size is nOut x nLat.
+    '''
+
+    nlat = kwargs.get('nlat', 18)
+    tfinal = kwargs.get('tfinal', 10000)
+    dt = kwargs.get('dt', 1.0)
+    dlat, lats = gen_grid(nlat)
+
+    # Pre-allocate output arrays:
+    nout = int(tfinal / dt) // stride + 1
+    times = np.zeros(nout)
+    Temp = np.zeros((nout, nlat))
+    albedo = np.zeros((nout, nlat))
+
+    for i, (t, T, alb) in enumerate(snowball_stream(stride=stride, **kwargs)):
+        times[i], Temp[i, :], albedo[i, :] = t, T, alb
+
+    return lats, times, Temp, albedo
+
+
+def ice_line(lats, albedo, albice=.6):
+    '''
+    Given the albedo history from `snowball_history`, find the latitude of
+    the ice edge closest to the equator in each hemisphere.
+
+    Parameters
+    ----------
+    lats : Numpy array
+        Latitudes of cell centers in degrees (0 is the south pole).
+    albedo : Numpy array
+        Albedo history, size is nOut x nLat.
+    albice : float, defaults to .6
+        Albedo value used to mark ice-covered cells.
+
+    Returns
+    -------
+    south, north : Numpy arrays
+        Equator-most ice-covered latitude (in degrees from the equator)
+        for the southern and northern hemisphere. Set to NaN where a
+        hemisphere is ice free.
+    '''
+
+    albedo = np.atleast_2d(albedo)
+    ice = np.isclose(albedo, albice)
+    equat = lats - 90.
+
+    south = np.full(albedo.shape[0], np.nan)
+    north = np.full(albedo.shape[0], np.nan)
+    for i in range(albedo.shape[0]):
+        loc = ice[i, :] & (equat < 0)
+        if loc.any():
+            south[i] = equat[loc].max()
+        loc = ice[i, :] & (equat > 0)
+        if loc.any():
+            north[i] = equat[loc].min()
+
+    return south, north
+
+
+def snowball_earth_2d(nlat=18, nlon=36, tfinal=10000, dt=1.0, lam=100.,
+                      lam_zonal=None, emiss=1.0, init_cond=temp_warm,
+                      apply_spherecorr=False, albice=.6, albgnd=.3,
+                      apply_insol=False, solar=1370, seasonal=False,
+                      dtype=np.float64):
+    '''
+    Solve the snowball Earth problem on a latitude-longitude grid.
+
+    The meridional direction is handled exactly as in `snowball_stream`
+    (same implicit operator and spherical correction, applied to every
+    longitude at once). Diffusion along the periodic longitude direction is
+    done implicitly in Fourier space: each zonal wavenumber `k` is damped by
+    `1/(1 + dt*lam_zonal*k^2/(R sin(lat))^2)`, so the zonal step costs
+    O(nLon log nLon) per latitude and is stable even at the poles. For a
+    zonally uniform state and albedo, the result matches `snowball_earth`.
+
+    Parameters
+    ----------
+    nlat : int, defaults to 18
+        Number of latitude cells.
+    nlon : int, defaults to 36
+        Number of longitude cells.
+    tfinal : int or float, defaults to 10,000
+        Time length of simulation in years.
+    dt : int or float, defaults to 1.0
+        Size of timestep in years.
+    lam : float, defaults to 100
+        Set ocean diffusivity in the meridional direction.
+    lam_zonal : float, defaults to None
+        Set ocean diffusivity in the zonal direction. Defaults to `lam`.
+    emiss : float, defaults to 1.0
+        Set emissivity of Earth/ground.
+    init_cond : function, float, or array
+        Set the initial condition of the simulation. If a function is given,
+        it must take latitudes as input and return temperature as a function
+        of lat; it is applied at every longitude. Otherwise, the given values
+        (a scalar or an nLat x nLon array) are used as-is.
+    apply_spherecorr : bool, defaults to False
+        Apply spherical correction term
+    albice, albgnd : float or array, defaults to .6 and .3
+        Set albedo values for ice and ground. Either may be an nLat x nLon
+        array (e.g., to place continents).
+    apply_insol : bool, defaults to False
+        Apply insolation term.
+    solar : float, defaults to 1370
+        Set level of solar forcing in W/m2
+    seasonal : bool, defaults to False
+        Use seasonally varying insolation; see `snowball_stream`.
+    dtype : Numpy dtype, defaults to np.float64
+        Floating point precision used throughout the solve.
+
+    Returns
+    --------
+    lats : Numpy array
+        Latitudes representing cell centers in degrees; 0 is south pole
+        180 is north.
+    lons : Numpy array
+        Longitudes representing cell centers in degrees east.
+    Temp : Numpy array
+        Temperature as a function of latitude and longitude, size
+        nLat x nLon.
+    '''
+
+    if lam_zonal is None:
+        lam_zonal = lam
+
+    # Get (possibly cached) grid and meridional operators:
+    lats, dy, B, Axz, dAxz, K, Linv = snowball_operators(nlat, dt, lam,
+                                                         dtype)
+    lons = (np.arange(nlon) + 0.5) * 360. / nlon
 
     # Set number of time steps:
     nsteps = int(tfinal / dt)
 
+    # Keep time step in years for table look ups:
+    dt_yr = dt
+
     # Set timestep to seconds:
     dt = dt * 365 * 24 * 3600
 
-    # Create insolation:
-    insol = insolation(solar, lats)
+    # Zonal implicit diffusion factor for every latitude and wavenumber:
+    wavenum = np.arange(nlon//2 + 1)
+    rzonal = radearth * np.sin(np.pi/180. * lats)
+    zonal = 1 / (1 + dt * lam_zonal * (wavenum[np.newaxis, :] /
+                                       rzonal[:, np.newaxis])**2)
+
+    # Create (or reuse) insolation; shape it to broadcast over longitude:
+    table, ndays = _insolation_forcing(solar, lats, nlat, dt_yr, dtype,
+                                       seasonal)
+    insol = table[0, :, np.newaxis]
 
     # Create temp array; set our initial condition
-    Temp = np.zeros(nlat)
+    Temp = np.zeros((nlat, nlon), dtype=dtype)
     if callable(init_cond):
-        Temp = init_cond(lats)
+        Temp += np.asarray(init_cond(lats), dtype=dtype)[:, np.newaxis]
     else:
         Temp += init_cond
 
-    # Create our K matrix:
-    K = np.zeros((nlat, nlat))
-    K[np.arange(nlat), np.arange(nlat)] = -2
-    K[np.arange(nlat-1)+1, np.arange(nlat-1)] = 1
-    K[np.arange(nlat-1), np.arange(nlat-1)+1] = 1
-    # Boundary conditions:
-    K[0, 1], K[-1, -2] = 2, 2
-    # Units!
-    K *= 1/dy**2
+    # Albedo values on the full grid:
+    albice = np.broadcast_to(albice, (nlat, nlon))
+    albgnd = np.broadcast_to(albgnd, (nlat, nlon))
+    albedo = np.zeros((nlat, nlon), dtype=dtype)
 
-    # Create L matrix.
-    Linv = np.linalg.inv(np.eye(nlat) - dt * lam * K)
-
-    # Set initial albedo.
-    albedo = np.zeros(nlat)
-    loc_ice = Temp <= -10  # Sea water freezes at ten below.
-    albedo[loc_ice] = albice
-    albedo[~loc_ice] = albgnd
+    # Spherical correction factor, shaped to broadcast over longitude:
+    corr = ((lam*dt) / (4*Axz*dy**2) * dAxz)[:, np.newaxis]
 
     # SOLVE!
     for istep in range(nsteps):
         # Update Albedo:
         loc_ice = Temp <= -10  # Sea water freezes at ten below.
-        albedo[loc_ice] = albice
-        albedo[~loc_ice] = albgnd
+        albedo[loc_ice] = albice[loc_ice]
+        albedo[~loc_ice] = albgnd[~loc_ice]
 
         # Create spherical coordinates correction term
         if apply_spherecorr:
-            sphercorr = (lam*dt) / (4*Axz*dy**2) * np.matmul(B, Temp) * dAxz
+            sphercorr = corr * np.matmul(B, Temp)
         else:
             sphercorr = 0
 
         # Apply radiative/insolation term:
         if apply_insol:
+            if ndays > 1:
+                insol = table[_insolation_day(istep, dt_yr, ndays), :,
+                              np.newaxis]
             radiative = (1-albedo)*insol - emiss*sigma*(Temp+273)**4
             Temp += dt * radiative / (rho*C*mxdlyr)
 
-        # Advance solution.
+        # Advance solution: meridional, then zonal diffusion.
         Temp = np.matmul(Linv, Temp + sphercorr)
+        Temp = np.fft.irfft(np.fft.rfft(Temp, axis=1) * zonal, n=nlon,
+                            axis=1).astype(dtype, copy=False)
 
-    return lats, Temp
+    return lats, lons, Temp
 
 
-def problem1():
+def snowball_steady(nlat=18, lam=100., emiss=1.0, init_cond=temp_warm,
+                    apply_spherecorr=False, albice=.6, albgnd=.3,
+                    apply_insol=False, solar=1370, tol=1e-6, maxiter=None,
+                    dt=1.0):
+    '''
+    Solve directly for the equilibrium of the snowball Earth problem, i.e.,
+    the temperature where diffusion, the spherical correction, and the
+    radiative term balance, instead of time stepping towards it. Uses the
+    same options as `snowball_earth`.
+
+    With the radiative term on, the balance is nonlinear (T^4 emission and
+    ice/ground albedo switching). The ice mask (cells at or below -10 C) is
+    taken from the initial condition and held fixed while Newton's method
+    with the sparse Jacobian solves the now smooth balance; steps are
+    halved until the residual drops. If the answer puts some cells on the
+    other side of -10 C, the solution is moved from where it started
+    towards the answer only as far as the first cell to cross, just that
+    cell's albedo is switched, and Newton is run again. This repeats until
+    the ice mask agrees with the temperature, so cells switch in the order
+    they would while time stepping, and the equilibrium found is the one
+    reached from the initial condition. A RuntimeWarning is raised if no
+    consistent equilibrium is found.
+
+    Without the radiative term, the problem is linear but singular (any
+    constant is a solution). Which constant `snowball_earth` settles to
+    depends on what its implicit time step conserves, which, with the
+    spherical correction on, depends on `dt`. The constant that keeps that
+    conserved quantity at its initial value is returned, i.e., the fixed
+    point of the time stepper itself.
+
+    Parameters
+    ----------
+    nlat : int, defaults to 18
+        Number of latitude cells.
+    lam : float, defaults to 100
+        Set ocean diffusivity
+    emiss : float, defaults to 1.0
+        Set emissivity of Earth/ground.
+    init_cond : function, float, or array
+        Set the initial condition (and starting guess). If a function is
+        given, it must take latitudes as input and return temperature as a
+        function of lat. Otherwise, the given values are used as-is.
+    apply_spherecorr : bool, defaults to False
+        Apply spherical correction term
+    albice, albgnd : float, defaults to .6 and .3
+        Set albedo values for ice and ground.
+    apply_insol : bool, defaults to False
+        Apply insolation term.
+    solar : float, defaults to 1370
+        Set level of solar forcing in W/m2
+    tol : float, defaults to 1E-6
+        Stop once the largest residual is below `tol` W/m2.
+    maxiter : int, defaults to None
+        Maximum total number of Newton iterations. Each switch of a cell
+        between ice and ground takes a few, so the default is `4*nlat + 50`.
+    dt : float, defaults to 1.0
+        Time step, in years, of the matching `snowball_earth` run. Only used
+        without the radiative term.
+
+    Returns
+    --------
+    lats : Numpy array
+        Latitudes representing cell centers in degrees; 0 is south pole
+        180 is north.
+    Temp : Numpy array
+        Equilibrium temperature as a function of latitude.
+    residual : float
+        Largest absolute residual of the energy balance for the returned
+        temperature (with the ice mask it implies), in W/m2.
+    niter : int
+        Number of iterations used.
+    '''
+
+    from scipy.sparse import csr_matrix, diags
+    from scipy.sparse.linalg import spsolve
+
+    # Get (possibly cached) grid and operators; dt only affects Linv.
+    lats, dy, B, Axz, dAxz, K, Linv = snowball_operators(nlat, dt, lam)
+    insol = _insolation_forcing(solar, lats, nlat, 1.0)[0][0, :]
+
+    # Set our initial condition
+    Temp = np.zeros(nlat)
+    if callable(init_cond):
+        Temp = np.array(init_cond(lats), dtype=float)
+    else:
+        Temp += init_cond
+
+    # Linear part of the balance, in W/m2 per degree: diffusion plus the
+    # spherical correction. These are the same terms the time stepper uses.
+    heatcap = rho*C*mxdlyr
+    D = lam * csr_matrix(K)
+    if apply_spherecorr:
+        D = D + diags(lam / (4*Axz*dy**2) * dAxz) @ csr_matrix(B)
+    D = (heatcap * D).tocsc()
+
+    # Without radiation, the balance is linear and singular. Build the
+    # one-step update matrix P of the time stepper and find the weights `w`
+    # it conserves (w @ P = w, the left singular vector of P - I with the
+    # smallest singular value); the equilibrium keeps w @ Temp equal to its
+    # initial value.
+    if not apply_insol:
+        P = np.eye(nlat)
+        if apply_spherecorr:
+            dt_sec = dt * 365 * 24 * 3600
+            P += (lam*dt_sec / (4*Axz*dy**2) * dAxz)[:, np.newaxis] * B
+        P = Linv @ P
+
+        w = np.linalg.svd(P - np.eye(nlat))[0][:, -1]
+        Temp = np.zeros(nlat) + (w @ Temp) / w.sum()
+        residual = float(np.abs(D @ Temp).max())
+        return lats, Temp, residual, 1
+
+    def balance(Temp, ice):
+        '''Return the net energy balance (W/m2) for a fixed ice mask.'''
+        albedo = np.where(ice, albice, albgnd)
+        return (D @ Temp + (1-albedo)*insol - emiss*sigma*(Temp+273)**4)
+
+    def newton(Temp, ice, niter):
+        '''Solve the balance for a fixed ice mask; return T, niter.'''
+        F = balance(Temp, ice)
+        residual = np.abs(F).max()
+        while residual > tol and niter < maxiter:
+            niter += 1
+            J = D - diags(4*emiss*sigma*(Temp+273)**3)
+            step = spsolve(J.tocsc(), -F)
+
+            # Halve the step until the residual improves; give up (keeping
+            # the last good solution) if it never does.
+            frac = 1.0
+            while frac > 1E-4:
+                new = Temp + frac*step
+                Fnew = balance(new, ice)
+                if np.abs(Fnew).max() < residual:
+                    break
+                frac /= 2
+            else:
+                break
+            Temp, F = new, Fnew
+            residual = np.abs(F).max()
+
+        return Temp, niter
+
+    if maxiter is None:
+        maxiter = 4*nlat + 50
+
+    # Outer loop: solve with a fixed ice mask, then switch cells one
+    # crossing at a time until the mask matches the temperature.
+    # `Temp` is the point on the path the time stepper would take where the
+    # last cell switched; `target` is the latest Newton answer for the
+    # current mask, and is what gets returned.
+    ice = Temp <= -10
+    seen = {ice.tobytes()}
+    niter, consistent = 0, False
+    target = Temp
+    while niter < maxiter:
+        # Only one or two cells switch each time, so the last answer is a
+        # good starting guess.
+        target, niter = newton(target, ice, niter)
+        flip = (target <= -10) != ice
+        if not flip.any():
+            consistent = True
+            break
+
+        # How far along the path to the answer does each cell cross -10?
+        # Move to the first crossing and switch only those cells.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frac = np.where(flip, (-10 - Temp) / (target - Temp), np.inf)
+        frac = np.clip(frac, 0, 1)
+        first = frac.min()
+        Temp = Temp + first*(target - Temp)
+        ice = ice ^ (flip & (frac <= first + 1E-12))
+
+        # Switching back to a mask we already tried means no consistent
+        # equilibrium exists near here (cells sit right on the threshold).
+        if ice.tobytes() in seen:
+            target, niter = newton(target, ice, niter)
+            break
+        seen.add(ice.tobytes())
+
+    # Residual of what we return, with the ice mask its own temperature
+    # gives (the same as the Newton residual if the mask is consistent):
+    residual = float(np.abs(balance(target, target <= -10)).max())
+    if residual > tol or not consistent:
+        import warnings
+        warnings.warn(f'snowball_steady did not converge after {niter} '
+                      f'iterations: residual = {residual:.3e} W/m2, ice '
+                      f'mask consistent = {consistent}.', RuntimeWarning)
+
+    return lats, target, residual, niter
+
+
+def check_snowball_precision(dtype=np.float32, **kwargs):
+    '''
+    Run `snowball_earth` in reduced precision and in double precision and
+    report the largest difference between the two. Extra kwargs are handed
+    to `snowball_earth`; by default all terms are turned on and the run is
+    kept short.
+
+    Parameters
+    ----------
+    dtype : Numpy dtype, defaults to np.float32
+        The reduced precision to check.
+
+    Returns
+    -------
+    maxdev : float
+        Maximum absolute temperature difference (C) from the float64
+        solution.
+    '''
+
+    kwargs.setdefault('tfinal', 1000)
+    kwargs.setdefault('apply_spherecorr', True)
+    kwargs.setdefault('apply_insol', True)
+
+    lats, temp_ref = snowball_earth(dtype=np.float64, **kwargs)
+    lats, temp = snowball_earth(dtype=dtype, **kwargs)
+    maxdev = np.abs(temp.astype(np.float64) - temp_ref).max()
+
+    print(f'snowball_earth in {np.dtype(dtype).name}: max deviation from '
+          f'float64 = {maxdev:.3e} C')
+
+    return maxdev
+
+
+def bench_seasonal(nlat=18, dt=1/365., years=(1, 10, 100)):
+    '''
+    Time the snowball Earth model with annual-mean and seasonal insolation
+    for runs of different lengths and print the cost per time step. Because
+    the seasonal forcing is a table lookup, its per-step cost should stay
+    flat and close to the annual-mean case.
+
+    Parameters
+    ----------
+    nlat : int, defaults to 18
+        Number of latitude cells.
+    dt : float, defaults to 1/365
+        Size of timestep in years.
+    years : list of floats, defaults to (1, 10, 100)
+        Run lengths to time, in years.
+
+    Returns
+    -------
+    cost : Numpy array
+        Time per step in seconds, size nYears x 2 (annual, seasonal).
+    '''
+
+    from time import perf_counter
+
+    # Build operators and tables once so only stepping is timed:
+    snowball_earth(nlat=nlat, dt=dt, tfinal=dt, apply_insol=True)
+    snowball_earth(nlat=nlat, dt=dt, tfinal=dt, apply_insol=True,
+                   seasonal=True)
+
+    cost = np.zeros((len(years), 2))
+    for i, tfinal in enumerate(years):
+        nsteps = int(tfinal / dt)
+        for j, seasonal in enumerate((False, True)):
+            start = perf_counter()
+            snowball_earth(nlat=nlat, dt=dt, tfinal=tfinal, apply_insol=True,
+                           apply_spherecorr=True, seasonal=seasonal)
+            cost[i, j] = (perf_counter() - start) / nsteps
+        print(f'{tfinal:8.1f} years ({nsteps:7d} steps): '
+              f'annual = {1e6*cost[i, 0]:6.2f}us/step, '
+              f'seasonal = {1e6*cost[i, 1]:6.2f}us/step')
+
+    return cost
+
+
+def problem1(cache=False):
     '''
     Create solution figure for Problem 1 (also validate our code qualitatively)
+
+    Parameters
+    ----------
+    cache : bool, defaults to False
+        Load previously computed solutions from disk (see `memo`) rather
+        than re-running the model.
     '''
 
+    solver = cached_snowball_earth if cache else snowball_earth
+
     # Get warm Earth initial condition.
     dlat, lats = gen_grid()
     temp_init = temp_warm(lats)
 
     # Get solution after 10K years for each combination of terms:
-    lats, temp_diff = snowball_earth()
-    lats, temp_sphe = snowball_earth(apply_spherecorr=True)
-    lats, temp_alls = snowball_earth(apply_spherecorr=True, apply_insol=True,
-                                     albice=.3)
+    lats, temp_diff = solver()
+    lats, temp_sphe = solver(apply_spherecorr=True)
+    lats, temp_alls = solver(apply_spherecorr=True, apply_insol=True,
+                             albice=.3)
 
     # Create a fancy plot!
     fig, ax = plt.subplots(1, 1)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+
+'''
+Disk-backed memoization for our solvers. Results are saved to disk under a
+stable hash of every argument the solver received, the source code of the
+whole module that defines the solver (so edits to helper functions in the
+same file count too), and a code version tag. Re-running an experiment with
+unchanged inputs and unchanged code just loads the answer back. Changes to
+code in *other* modules are not detected; bump `CODE_VERSION` (or clear the
+cache) after those. The cache is capped in size; the least recently used
+results are removed first.
+
+Functions handed in as arguments (boundary conditions, initial conditions)
+are hashed by their code, default values, and the values they close over.
+Calls with arguments that cannot be hashed stably, e.g., a `lambda` typed
+at the interactive prompt or an object whose `repr` is just its address,
+are run without the cache.
+
+Results are stored in `~/.cache/clasp410` unless the `CLASP410_CACHE`
+environment variable says otherwise.
+'''
+
+import os
+import sys
+import types
+import pickle
+import hashlib
+import inspect
+import functools
+
+import numpy as np
+
+# Bump this to invalidate every cached result, e.g., after changing code a
+# solver relies on from another module:
+CODE_VERSION = '1'
+
+default_dir = os.environ.get(
+    'CLASP410_CACHE', os.path.join(os.path.expanduser('~'), '.cache',
+                                   'clasp410'))
+
+
+@functools.lru_cache(maxsize=None)
+def _file_digest(path, mtime, size):
+    '''
+    Return a digest of the file at `path`. The modification time and size
+    are only part of the cache key, so edited files are read again.
+    '''
+
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _module_digest(modname):
+    '''
+    Return a digest of the source file of module `modname`, or None if it
+    has none (e.g., interactive sessions).
+    '''
+
+    path = getattr(sys.modules.get(modname), '__file__', None)
+    if path is None:
+        return None
+
+    try:
+        stat = os.stat(path)
+        return _file_digest(path, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+def _source_digest(func):
+    '''
+    Return a digest of the code behind `func`: the source of its whole
+    defining module if available (this covers helpers it calls from the
+    same file), otherwise the source of `func` itself. Raises ValueError
+    if neither can be found.
+    '''
+
+    digest = _module_digest(getattr(func, '__module__', None))
+    if digest is not None:
+        return digest
+
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        raise ValueError(f'No source code found for {func!r}.')
+
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def _token(obj):
+    '''
+    Turn `obj` into a nested structure of plain values whose `repr` is stable
+    between Python sessions. Arrays are reduced to a digest of their contents.
+    Functions are reduced to their name, a digest of their module's source
+    code, their compiled code, their default values, and the contents of
+    their closure, so two closures made by the same factory with different
+    values differ. Raises ValueError for objects that cannot be reduced
+    stably.
+    '''
+
+    if isinstance(obj, np.ndarray):
+        data = np.ascontiguousarray(obj)
+        return ('ndarray', data.dtype.str, data.shape,
+                hashlib.sha256(data.tobytes()).hexdigest())
+    if isinstance(obj, np.generic):
+        return _token(obj.item())
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__name__,) + tuple(_token(o) for o in obj)
+    if isinstance(obj, (set, frozenset)):
+        return (type(obj).__name__,) + tuple(sorted((_token(o) for o in obj),
+                                                    key=repr))
+    if isinstance(obj, dict):
+        return ('dict',) + tuple((repr(k), _token(obj[k]))
+                                 for k in sorted(obj, key=repr))
+    if isinstance(obj, types.FunctionType):
+        closure = obj.__closure__ or ()
+        return ('func', obj.__module__, obj.__qualname__, _source_digest(obj),
+                _token(obj.__code__), _token(obj.__defaults__),
+                _token(obj.__kwdefaults__),
+                tuple(_token(cell.cell_contents) for cell in closure))
+    if isinstance(obj, types.CodeType):
+        return ('code', obj.co_name, obj.co_names,
+                hashlib.sha256(obj.co_code).hexdigest(),
+                tuple(_token(c) for c in obj.co_consts))
+    if isinstance(obj, types.MethodType):
+        return ('method', _token(obj.__self__), _token(obj.__func__))
+    if isinstance(obj, functools.partial):
+        return ('partial', _token(obj.func), _token(obj.args),
+                _token(obj.keywords))
+    if isinstance(obj, type):
+        return ('class', obj.__module__, obj.__qualname__, _source_digest(obj))
+    if isinstance(obj, float):
+        return ('float', float(obj).hex())
+
+    # Anything else (builtins, ufuncs, plain values) by type and `repr`,
+    # unless the `repr` is only a memory address:
+    text = repr(obj)
+    if ' at 0x' in text:
+        raise ValueError(f'Cannot hash {text} stably.')
+
+    return (type(obj).__name__, text)
+
+
+def arg_hash(func, args=(), kwargs={}, version=CODE_VERSION):
+    '''
+    Return a stable hex digest for calling `func` with `args` and `kwargs`.
+    Default values are filled in first, so `f(1)` and `f(x=1)` agree.
+    Raises ValueError if any argument cannot be hashed stably.
+
+    Parameters
+    ----------
+    func : function
+        The function being called.
+    args, kwargs : tuple and dict
+        The arguments handed to `func`.
+    version : str, defaults to `CODE_VERSION`
+        Code version tag mixed into the hash.
+
+    Returns
+    -------
+    key : str
+        Hex digest identifying this call.
+    '''
+
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+
+    try:
+        tokens = (version, _token(func), _token(dict(bound.arguments)))
+    except (ValueError, RecursionError) as err:
+        raise ValueError(f'Cannot hash call to {func.__qualname__}: {err}')
+
+    return hashlib.sha256(repr(tokens).encode()).hexdigest()
+
+
+class DiskCache:
+    '''
+    A directory of pickled results, capped in total size with least
+    recently used eviction.
+
+    Parameters
+    ----------
+    cachedir : str, defaults to `default_dir`
+        Folder in which to store results. Created if it does not exist.
+    maxbytes : int, defaults to 1GB
+        Maximum total size of all stored results.
+    '''
+
+    def __init__(self, cachedir=None, maxbytes=1024**3):
+        self.cachedir = default_dir if cachedir is None else cachedir
+        self.maxbytes = maxbytes
+        self.hits, self.misses = 0, 0
+
+    def _path(self, key):
+        return os.path.join(self.cachedir, key + '.pkl')
+
+    def _entries(self):
+        '''Return (path, size, last access time) for every stored result.'''
+
+        if not os.path.isdir(self.cachedir):
+            return []
+        entries = []
+        for name in os.listdir(self.cachedir):
+            if not name.endswith('.pkl'):
+                continue
+            path = os.path.join(self.cachedir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+
+        return entries
+
+    def load(self, key):
+        '''
+        Load the result stored under `key`.
+
+        Returns
+        -------
+        hit : bool
+            True if a result was found.
+        value : object
+            The stored result, or None if there was none.
+        '''
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return False, None
+
+        # Mark as recently used:
+        os.utime(path)
+        self.hits += 1
+
+        return True, value
+
+    def save(self, key, value):
+        '''Store `value` under `key`, then evict old results as needed.'''
+
+        os.makedirs(self.cachedir, exist_ok=True)
+
+        # Write to a temporary file first so readers never see half a file:
+        path = self._path(key)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+        self.evict()
+
+    def evict(self):
+        '''Remove least recently used results until under `maxbytes`.'''
+
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(e[1] for e in entries)
+        for path, size, atime in entries:
+            if total <= self.maxbytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        '''Remove all stored results and reset hit/miss statistics.'''
+
+        for path, size, atime in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.hits, self.misses = 0, 0
+
+    def stats(self):
+        '''
+        Return a dictionary of cache statistics: number of hits and misses,
+        the number of stored results and their total size in bytes.
+        '''
+
+        entries = self._entries()
+
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(entries), 'nbytes': sum(e[1] for e in entries),
+                'maxbytes': self.maxbytes, 'cachedir': self.cachedir}
+
+
+# Cache shared by all memoized solvers:
+disk_cache = DiskCache()
+
+
+def memoize(func=None, cache=None, version=CODE_VERSION, skip=None):
+    '''
+    Wrap solver `func` so that results are loaded from disk when it has
+    already been called with the same arguments. Can be used directly,
+    `memoize(func)`, or as a decorator, `@memoize(skip=...)`.
+
+    Parameters
+    ----------
+    func : function
+        The solver to wrap. Results must be picklable.
+    cache : DiskCache, defaults to `disk_cache`
+        Where to store results.
+    version : str, defaults to `CODE_VERSION`
+        Code version tag; changing it invalidates old results.
+    skip : function, defaults to None
+        Takes the dictionary of bound arguments and returns True if the call
+        should not be cached (e.g., random runs without a seed). Calls whose
+        arguments cannot be hashed stably are never cached.
+
+    Returns
+    -------
+    wrapped : function
+        The memoized solver. The underlying cache is available as
+        `wrapped.cache`.
+    '''
+
+    if func is None:
+        return functools.partial(memoize, cache=cache, version=version,
+                                 skip=skip)
+
+    @functools.wraps(func)
+    def wrapped(*args, **kwargs):
+        store = wrapped.cache
+
+        if skip is not None:
+            bound = inspect.signature(func).bind(*args, **kwargs)
+            bound.apply_defaults()
+            if skip(bound.arguments):
+                return func(*args, **kwargs)
+
+        try:
+            key = arg_hash(func, args, kwargs, version=version)
+        except ValueError:
+            return func(*args, **kwargs)
+        hit, value = store.load(key)
+        if not hit:
+            value = func(*args, **kwargs)
+            store.save(key, value)
+
+        return value
+
+    wrapped.cache = disk_cache if cache is None else cache
+
+    return wrapped
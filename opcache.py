@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+'''
+A small, bounded cache for prebuilt operators (matrices, factorizations, and
+other arrays) that only depend on a handful of structural parameters.
+Solvers ask the cache for their operators by key and only build them on a
+miss, so repeated calls with the same grid skip the setup entirely.
+'''
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _nbytes(value):
+    '''
+    Estimate the memory footprint, in bytes, of a cached value. Numpy arrays
+    are counted directly; tuples, lists, and dicts are searched recursively.
+    Anything else counts as zero.
+    '''
+
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+
+    return 0
+
+
+def _freeze(value):
+    '''
+    Mark every Numpy array in a cached value (searching tuples, lists, and
+    dicts recursively) as read-only, since the same arrays are handed to
+    every caller.
+    '''
+
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            _freeze(v)
+    elif isinstance(value, dict):
+        for v in value.values():
+            _freeze(v)
+
+
+class OperatorCache:
+    '''
+    Least-recently-used cache of solver operators, capped in both number of
+    entries and total memory.
+
+    Parameters
+    ----------
+    maxsize : int, defaults to 32
+        Maximum number of entries to keep.
+    maxbytes : int, defaults to 256MB
+        Maximum total size of all cached arrays in bytes. Entries that are
+        larger than this on their own are built but never stored.
+    '''
+
+    def __init__(self, maxsize=32, maxbytes=256*1024**2):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._store = OrderedDict()
+        self._sizes = {}
+        self.hits, self.misses, self.nbytes = 0, 0, 0
+
+    def __len__(self):
+        return len(self._store)
+
+    def __contains__(self, key):
+        return key in self._store
+
+    def get(self, key, builder):
+        '''
+        Return the operators stored under `key`. On a miss, call `builder()`
+        to create them and store the result.
+
+        Parameters
+        ----------
+        key : hashable
+            The structural parameters that uniquely define the operators.
+        builder : function
+            Takes no arguments and returns the operators for `key`.
+
+        Returns
+        -------
+        value : object
+            Whatever `builder` returned for this key. Arrays are made
+            read-only because the same objects are handed to every caller;
+            copy them before modifying.
+        '''
+
+        if key in self._store:
+            self.hits += 1
+            self._store.move_to_end(key)
+            return self._store[key]
+
+        self.misses += 1
+        value = builder()
+        _freeze(value)
+        size = _nbytes(value)
+
+        # Too big to ever fit? Hand it back without storing.
+        if size > self.maxbytes or self.maxsize < 1:
+            return value
+
+        self._store[key] = value
+        self._sizes[key] = size
+        self.nbytes += size
+
+        # Evict oldest entries until we are back within our limits:
+        while len(self._store) > self.maxsize or self.nbytes > self.maxbytes:
+            old, _ = self._store.popitem(last=False)
+            self.nbytes -= self._sizes.pop(old)
+
+        return value
+
+    def clear(self):
+        '''Remove all entries and reset the hit/miss statistics.'''
+
+        self._store.clear()
+        self._sizes.clear()
+        self.hits, self.misses, self.nbytes = 0, 0, 0
+
+    def stats(self):
+        '''
+        Return a dictionary of cache statistics: number of hits and misses,
+        the current number of entries and their total size in bytes.
+        '''
+
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._store), 'nbytes': self.nbytes,
+                'maxsize': self.maxsize, 'maxbytes': self.maxbytes}
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+'''
+Run batches of experiments from the command line.
+
+Jobs are read from a JSON file holding a list of jobs. Each job names a
+solver, a set of fixed parameters, and (optionally) a parameter grid; every
+combination of grid values becomes its own run. For example::
+
+    [{"solver": "snowball_earth",
+      "params": {"apply_spherecorr": true, "apply_insol": true},
+      "grid": {"lam": [50, 100, 150], "emiss": [0.7, 0.8, 0.9, 1.0]}},
+     {"solver": "forest_fire",
+      "params": {"isize": 100, "jsize": 100, "nstep": 200, "seed": 410},
+      "grid": {"pspread": [0.2, 0.4, 0.6, 0.8, 1.0]}}]
+
+Runs are spread across a pool of processes, biggest first, and each result
+is pickled to its own file in the output folder as a dictionary with keys
+`solver`, `params`, `result`, and `time`. Runs whose output file already
+exists are skipped, so an interrupted batch can simply be started again.
+
+Usage::
+
+    python run_batch.py jobs.json -o results/ -n 4
+'''
+
+import os
+import json
+import pickle
+import hashlib
+import argparse
+import itertools
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Solver name: (module, function name)
+solvers = {'snowball_earth': ('lab05_snowball', 'snowball_earth'),
+           'solve_heat': ('lab03_diffuse', 'solve_heat'),
+           'forest_fire': ('lab04_forest', 'forest_fire'),
+           'n_layer_atmos': ('lab01_nlayer', 'n_layer_atmos'),
+           'solve_euler': ('coffee_problem', 'solve_euler')}
+
+# Parameters that take functions; JSON gives these as names of functions
+# in the solver's module:
+func_params = ('dfx', 'init_cond', 'lowerbound', 'upperbound')
+
+
+def expand_jobs(jobs):
+    '''
+    Expand every job's parameter grid into a list of individual runs.
+
+    Parameters
+    ----------
+    jobs : list of dicts
+        Jobs as read from the JSON file. Each has a `solver` and optional
+        `params` (fixed values) and `grid` (lists of values to combine).
+
+    Returns
+    -------
+    runs : list of dicts
+        One dictionary per run with keys `solver`, `params`, and `id`.
+    '''
+
+    runs = []
+    for job in jobs:
+        solver = job['solver']
+        if solver not in solvers:
+            raise ValueError(f'Unknown solver "{solver}". '
+                             f'Choose from: {", ".join(solvers)}')
+        params = job.get('params', {})
+        grid = job.get('grid', {})
+        names = sorted(grid)
+        for values in itertools.product(*[grid[n] for n in names]):
+            run = dict(params, **dict(zip(names, values)))
+            # Stable ID from the solver and its full parameter set:
+            text = json.dumps([solver, run], sort_keys=True)
+            runid = hashlib.sha256(text.encode()).hexdigest()[:16]
+            runs.append({'solver': solver, 'params': run,
+                         'id': f'{solver}_{runid}'})
+
+    return runs
+
+
+def job_cost(run):
+    '''
+    Estimate the relative cost of a run so the biggest can be started first.
+    Uses each solver's defaults for anything not set.
+    '''
+
+    p = run['params']
+    solver = run['solver']
+
+    if solver == 'snowball_earth':
+        return p.get('nlat', 18)**2 * p.get('tfinal', 10000)/p.get('dt', 1.)
+    elif solver == 'solve_heat':
+        return (p.get('xstop', 1)/p.get('dx', .2) *
+                p.get('tstop', .2)/p.get('dt', .02))
+    elif solver == 'forest_fire':
+        return p.get('isize', 3) * p.get('jsize', 3) * p.get('nstep', 4)
+    elif solver == 'n_layer_atmos':
+        return (p.get('nlayers', 1) + 1)**2
+    elif solver == 'solve_euler':
+        return (p.get('t_final', 300.) - p.get('t_start', 0.))/p.get('dt', .25)
+
+    return 0
+
+
+def get_solver(solver, params={}):
+    '''
+    Look up a solver by name and prepare its parameters, swapping names of
+    functions (e.g., `"dfx": "newtcool"`) for the functions themselves.
+
+    Parameters
+    ----------
+    solver : str
+        Name of the solver; one of the keys of `solvers`.
+    params : dict
+        Parameters for the solver as read from JSON.
+
+    Returns
+    -------
+    func : function
+        The solver function.
+    params : dict
+        A copy of `params` ready to hand to `func`.
+    '''
+
+    from importlib import import_module
+
+    if solver not in solvers:
+        raise ValueError(f'Unknown solver "{solver}". '
+                         f'Choose from: {", ".join(solvers)}')
+
+    modname, funcname = solvers[solver]
+    module = import_module(modname)
+    func = getattr(module, funcname)
+
+    params = dict(params)
+    for name in func_params:
+        if isinstance(params.get(name), str):
+            params[name] = getattr(module, params[name])
+    if solver == 'solve_euler' and 'dfx' not in params:
+        params['dfx'] = module.newtcool
+
+    return func, params
+
+
+def run_job(run, outdir):
+    '''
+    Run a single job and pickle the result to `outdir`.
+
+    Returns
+    -------
+    runid : str
+        ID of the run.
+    elapsed : float
+        Time taken by the solver in seconds.
+    '''
+
+    func, params = get_solver(run['solver'], run['params'])
+
+    start = perf_counter()
+    result = func(**params)
+    elapsed = perf_counter() - start
+
+    # Write to a temporary file first so that half-written results are never
+    # mistaken for finished ones:
+    path = os.path.join(outdir, run['id'] + '.pkl')
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump({'solver': run['solver'], 'params': run['params'],
+                     'result': result, 'time': elapsed}, f)
+    os.replace(tmp, path)
+
+    return run['id'], elapsed
+
+
+def run_batch(jobs, outdir='results/', nproc=None):
+    '''
+    Expand, schedule, and run a list of jobs. See the module docstring for
+    the job format.
+
+    Parameters
+    ----------
+    jobs : list of dicts
+        Jobs to run.
+    outdir : str, defaults to 'results/'
+        Folder in which to save results.
+    nproc : int, defaults to None
+        Number of worker processes. Defaults to the number of CPUs.
+
+    Returns
+    -------
+    nrun, nskip : int
+        Number of runs completed and number skipped as already done.
+    failed : list of tuples
+        (run ID, error message) for every run that raised an error. Failed
+        runs leave no output file, so they are tried again on resume.
+    '''
+
+    os.makedirs(outdir, exist_ok=True)
+
+    runs = expand_jobs(jobs)
+    todo = [run for run in runs
+            if not os.path.exists(os.path.join(outdir, run['id'] + '.pkl'))]
+    nskip = len(runs) - len(todo)
+    print(f'{len(runs)} runs total; {nskip} already done, {len(todo)} to go.')
+
+    # Biggest runs first so the pool does not end up waiting on one:
+    todo.sort(key=job_cost, reverse=True)
+
+    start = perf_counter()
+    failed = []
+    with ProcessPoolExecutor(nproc) as pool:
+        futures = {pool.submit(run_job, run, outdir): run['id']
+                   for run in todo}
+        for i, future in enumerate(as_completed(futures)):
+            wall = perf_counter() - start
+            # Report failures but keep going with the rest of the batch:
+            try:
+                runid, elapsed = future.result()
+            except Exception as err:
+                runid = futures[future]
+                failed.append((runid, f'{type(err).__name__}: {err}'))
+                print(f'[{i+1:5d}/{len(todo)}] {runid} FAILED: '
+                      f'{failed[-1][1]}')
+                continue
+            print(f'[{i+1:5d}/{len(todo)}] {runid} took {elapsed:.2f}s '
+                  f'({(i+1)/wall:.2f} runs/s)')
+
+    if failed:
+        print(f'{len(failed)} of {len(todo)} runs failed:')
+        for runid, error in failed:
+            print(f'\t{runid}: {error}')
+
+    return len(todo) - len(failed), nskip, failed
+
+
+def main(argv=None):
+    '''Command line interface; see `python run_batch.py --help`.'''
+
+    parser = argparse.ArgumentParser(
+        description='Run a batch of CLaSP 410 experiments from a JSON file.')
+    parser.add_argument('jobfile', help='JSON file with a list of jobs.')
+    parser.add_argument('-o', '--outdir', default='results/',
+                        help='Folder for results (default: %(default)s)')
+    parser.add_argument('-n', '--nproc', type=int, default=None,
+                        help='Number of worker processes (default: all CPUs)')
+    args = parser.parse_args(argv)
+
+    with open(args.jobfile, 'r') as f:
+        jobs = json.load(f)
+
+    nrun, nskip, failed = run_batch(jobs, outdir=args.outdir,
+                                    nproc=args.nproc)
+
+    # Non-zero exit status if anything failed:
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -64,3 +64,143 @@ def compare_warming():
 
     fig.tight_layout()
 
+
+def read_forcing(filename, chunksize=100000):
+    '''
+    Stream a solar forcing series from disk in chunks so that records that
+    span centuries never have to fit in memory at once.
+
+    Files ending in `.npy` are memory-mapped and must hold an N x 3 array.
+    Anything else is read as text (e.g., CSV) with three columns: time,
+    solar forcing in W/m2, and temperature anomaly in C. Lines starting with
+    "#" and a single non-numeric header line are skipped.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the forcing file.
+    chunksize : int, defaults to 100,000
+        Number of records to read at a time.
+
+    Yields
+    ------
+    time, s0, t_anom : Numpy arrays
+        Time, solar forcing, and temperature anomaly for each chunk.
+    '''
+
+    from itertools import islice
+
+    # Binary files: memory map and slice.
+    if filename.endswith('.npy'):
+        data = np.load(filename, mmap_mode='r')
+        for i in range(0, data.shape[0], chunksize):
+            chunk = np.array(data[i:i+chunksize, :3], dtype=float)
+            yield chunk[:, 0], chunk[:, 1], chunk[:, 2]
+        return
+
+    # Text files: read `chunksize` lines at a time.
+    delim = ',' if filename.endswith('.csv') else None
+    with open(filename, 'r') as f:
+        first = True
+        while True:
+            # Only stop at the end of the file; a chunk may hold nothing but
+            # comments or blank lines.
+            raw = list(islice(f, chunksize))
+            if not raw:
+                break
+            lines = [line for line in raw
+                     if line.strip() and not line.lstrip().startswith('#')]
+            if not lines:
+                continue
+            # Skip a header line if there is one:
+            if first:
+                first = False
+                try:
+                    float(lines[0].split(delim)[0])
+                except ValueError:
+                    lines = lines[1:]
+                if not lines:
+                    continue
+            chunk = np.loadtxt(lines, delimiter=delim, ndmin=2)
+            yield chunk[:, 0], chunk[:, 1], chunk[:, 2]
+
+
+def eval_forcing(filename, albedo=0.33, epsilon=1.0, chunksize=100000):
+    '''
+    Evaluate `temp_1layer` over a forcing series stored on disk for every
+    combination of albedo and epsilon, one chunk of records at a time.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the forcing file; see `read_forcing` for formats.
+    albedo : float or array-like, defaults to 0.33
+        Albedo values to try.
+    epsilon : float or array-like, defaults to 1.0
+        Atmospheric emissivity values to try.
+    chunksize : int, defaults to 100,000
+        Number of records to evaluate at a time.
+
+    Yields
+    ------
+    time : Numpy array
+        Time of each record in the chunk.
+    te : Numpy array
+        Surface temperature, size nTime x nAlbedo x nEpsilon.
+    t_anom : Numpy array
+        Observed temperature anomaly of each record in the chunk.
+    '''
+
+    # Shape scenario axes for broadcasting against time:
+    albedo = np.atleast_1d(albedo)[np.newaxis, :, np.newaxis]
+    epsilon = np.atleast_1d(epsilon)[np.newaxis, np.newaxis, :]
+
+    for time, s0_chunk, t_anom_chunk in read_forcing(filename, chunksize):
+        te = temp_1layer(s0=s0_chunk[:, np.newaxis, np.newaxis],
+                         albedo=albedo, epsilon=epsilon)
+        yield time, te, t_anom_chunk
+
+
+def scan_forcing(filename, outfile, albedo=0.33, epsilon=1.0,
+                 chunksize=100000):
+    '''
+    Evaluate `temp_1layer` over a forcing series for a grid of albedo and
+    epsilon values, writing results to disk as each chunk is finished.
+    Memory use is bounded by `chunksize` no matter how long the series is.
+
+    The output is raw float64 binary with one record per time, each record
+    holding time followed by the nAlbedo x nEpsilon temperatures (in C
+    order). Read it back with::
+
+        data = np.fromfile(outfile).reshape(-1, 1 + nalb*neps)
+        time, te = data[:, 0], data[:, 1:].reshape(-1, nalb, neps)
+
+    Parameters
+    ----------
+    filename : str
+        Path to the forcing file; see `read_forcing` for formats.
+    outfile : str
+        Path to the output file. It is overwritten.
+    albedo : float or array-like, defaults to 0.33
+        Albedo values to try.
+    epsilon : float or array-like, defaults to 1.0
+        Atmospheric emissivity values to try.
+    chunksize : int, defaults to 100,000
+        Number of records to read, evaluate, and write at a time.
+
+    Returns
+    -------
+    nrecords : int
+        Total number of time records written.
+    '''
+
+    nrecords = 0
+    with open(outfile, 'wb') as out:
+        for time, te, t_anom_chunk in eval_forcing(filename, albedo, epsilon,
+                                                   chunksize):
+            record = np.concatenate([time[:, np.newaxis],
+                                     te.reshape(time.size, -1)], axis=1)
+            record.astype(np.float64).tofile(out)
+            nrecords += time.size
+
+    return nrecords
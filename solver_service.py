@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+'''
+A long-lived local service for running our solvers interactively.
+
+The service listens on a Unix socket (or a localhost TCP port) and keeps a
+pool of worker processes alive. Each worker imports the solvers once and
+builds the common operators and insolation tables up front, so requests
+skip interpreter start up and model set up entirely.
+
+Requests and responses are single lines of JSON. A request looks like::
+
+    {"id": 1, "solver": "snowball_earth", "params": {"lam": 50}}
+
+Solver names and parameters are the same as for `run_batch.py`. Many
+requests may be sent on one connection without waiting; each response is
+written back as soon as its run finishes (so possibly out of order) and
+carries the request's `id`::
+
+    {"id": 1, "ok": true, "time": 0.03, "result": [[...], [...]]}
+    {"id": 2, "ok": false, "error": "ValueError: ..."}
+
+Request lines longer than `max_request` bytes get an error response, after
+which the connection is closed.
+
+Start the service with::
+
+    python solver_service.py --socket /tmp/clasp410.sock
+'''
+
+import os
+import json
+import stat
+import signal
+import socket
+import asyncio
+import argparse
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from run_batch import solvers, get_solver
+
+# Longest request line accepted, in bytes (big `init_cond` arrays and the
+# like are sent inline):
+max_request = 64*1024**2
+
+
+def _warm_worker():
+    '''
+    Pool initializer: import every solver and build the default snowball
+    Earth operators and insolation so the first request is already fast.
+    '''
+
+    from importlib import import_module
+
+    # Ctrl-C goes to the whole process group; let the service shut us down.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    for modname, funcname in solvers.values():
+        import_module(modname)
+
+    import lab05_snowball
+    lab05_snowball.snowball_stream(tfinal=0).__next__()
+    lab05_snowball.snowball_stream(tfinal=0, apply_insol=True).__next__()
+
+
+def _jsonable(obj):
+    '''Convert solver results (arrays, tuples, numpy scalars) for JSON.'''
+
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (list, tuple)):
+        return [_jsonable(o) for o in obj]
+
+    return obj
+
+
+def _run(solver, params):
+    '''Run one request in a worker process; return (result, run time).'''
+
+    func, params = get_solver(solver, params)
+
+    start = perf_counter()
+    result = func(**params)
+
+    return _jsonable(result), perf_counter() - start
+
+
+async def _handle(reader, writer, pool):
+    '''Serve one client connection until it closes.'''
+
+    loop = asyncio.get_running_loop()
+    lock = asyncio.Lock()
+    tasks = set()
+
+    async def send(response):
+        # Only one response written at a time:
+        try:
+            async with lock:
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass  # Client went away; nobody left to answer.
+
+    async def respond(line):
+        reqid = None
+        try:
+            request = json.loads(line)
+            reqid = request.get('id')
+            result, elapsed = await loop.run_in_executor(
+                pool, _run, request['solver'], request.get('params', {}))
+            response = {'id': reqid, 'ok': True, 'time': elapsed,
+                        'result': result}
+        except Exception as err:
+            response = {'id': reqid, 'ok': False,
+                        'error': f'{type(err).__name__}: {err}'}
+
+        await send(response)
+
+    # Start a task per request as soon as it arrives:
+    while True:
+        try:
+            line = await reader.readline()
+        except ConnectionError:
+            break
+        except (ValueError, asyncio.LimitOverrunError):
+            # Line too long. The rest of it may still be on its way, so
+            # there is no telling where the next request starts; answer
+            # with an error and stop reading from this client.
+            await send({'id': None, 'ok': False,
+                        'error': f'ValueError: request longer than '
+                                 f'{max_request} bytes'})
+            break
+        if not line:
+            break
+        if not line.strip():
+            continue
+        task = asyncio.create_task(respond(line))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    writer.close()
+
+
+async def serve(path=None, host='127.0.0.1', port=4100, nproc=None):
+    '''
+    Run the service until it receives SIGTERM or SIGINT, then stop the
+    worker pool and remove the socket.
+
+    Parameters
+    ----------
+    path : str, defaults to None
+        Path of a Unix socket to listen on. If not given, listen on TCP
+        `host`:`port` instead.
+    host : str, defaults to '127.0.0.1'
+        Address to listen on when no socket path is given.
+    port : int, defaults to 4100
+        Port to listen on when no socket path is given.
+    nproc : int, defaults to None
+        Number of worker processes. Defaults to the number of CPUs.
+    '''
+
+    nwork = os.cpu_count() if nproc is None else nproc
+    pool = ProcessPoolExecutor(nwork, initializer=_warm_worker)
+
+    # Start workers now rather than on the first request:
+    await asyncio.gather(*[asyncio.get_running_loop().run_in_executor(
+        pool, os.getpid) for i in range(nwork)])
+
+    def client(reader, writer):
+        return _handle(reader, writer, pool)
+
+    if path is not None:
+        # Only ever replace a stale socket, never some other file:
+        if os.path.exists(path):
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                pool.shutdown()
+                raise FileExistsError(f'{path} exists and is not a socket.')
+            os.remove(path)
+        server = await asyncio.start_unix_server(client, path=path,
+                                                 limit=max_request)
+        where = path
+    else:
+        server = await asyncio.start_server(client, host=host, port=port,
+                                            limit=max_request)
+        where = f'{host}:{port}'
+
+    # Stop cleanly on SIGTERM (e.g., `kill`) as well as Ctrl-C:
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    print(f'Serving with {nwork} workers on {where}', flush=True)
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        pool.shutdown(cancel_futures=True)
+        if path is not None and os.path.exists(path) and \
+                stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+
+
+class SolverClient:
+    '''
+    A simple blocking client for the solver service.
+
+    Parameters
+    ----------
+    path : str, defaults to None
+        Unix socket to connect to. If not given, connect to `host`:`port`.
+    host : str, defaults to '127.0.0.1'
+        Address of the service.
+    port : int, defaults to 4100
+        Port of the service.
+    '''
+
+    def __init__(self, path=None, host='127.0.0.1', port=4100):
+        if path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(path)
+        else:
+            self.sock = socket.create_connection((host, port))
+        self.file = self.sock.makefile('rwb')
+        self.nextid = 0
+
+    def send(self, solver, **params):
+        '''Send a request without waiting; returns the request id.'''
+
+        self.nextid += 1
+        request = {'id': self.nextid, 'solver': solver, 'params': params}
+        self.file.write(json.dumps(request).encode() + b'\n')
+        self.file.flush()
+
+        return self.nextid
+
+    def receive(self):
+        '''Wait for the next response and return it as a dictionary.'''
+
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError('Solver service closed the connection.')
+
+        return json.loads(line)
+
+    def call(self, solver, **params):
+        '''
+        Run `solver` with `params` on the service and return its result.
+        Must not be mixed with outstanding `send` requests.
+        '''
+
+        self.send(solver, **params)
+        response = self.receive()
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+
+        return response['result']
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def bench_latency(nrequest=50, solver='snowball_earth', nproc=2, **params):
+    '''
+    Compare the latency of running a solver through the service against
+    starting a fresh Python process for it. The service is started in a
+    subprocess on a temporary Unix socket and shut down afterwards.
+    Extra kwargs are handed to the solver.
+
+    Parameters
+    ----------
+    nrequest : int, defaults to 50
+        Number of requests to time through the service.
+    solver : str, defaults to 'snowball_earth'
+        Solver to run.
+    nproc : int, defaults to 2
+        Number of service worker processes.
+
+    Returns
+    -------
+    cold : float
+        Time, in seconds, for one run in a fresh Python process.
+    warm : Numpy array
+        Round trip time, in seconds, of every request through the service.
+    '''
+
+    import sys
+    import shutil
+    import tempfile
+    import subprocess
+
+    if solver == 'snowball_earth':
+        params.setdefault('tfinal', 100)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'clasp410.sock')
+
+    # Cold start: a whole new interpreter for a single run.
+    script = ('from run_batch import get_solver; import json, sys; '
+              'f, p = get_solver(sys.argv[1], json.loads(sys.argv[2])); '
+              'f(**p)')
+    start = perf_counter()
+    subprocess.run([sys.executable, '-c', script, solver, json.dumps(params)],
+                   cwd=here, check=True)
+    cold = perf_counter() - start
+
+    # Warm: start the service and wait for it to report in.
+    proc = subprocess.Popen([sys.executable, 'solver_service.py', '--socket',
+                             path, '-n', str(nproc)], cwd=here,
+                            stdout=subprocess.PIPE)
+    try:
+        proc.stdout.readline()
+        client = SolverClient(path)
+
+        warm = np.zeros(nrequest)
+        for i in range(nrequest):
+            start = perf_counter()
+            client.call(solver, **params)
+            warm[i] = perf_counter() - start
+        client.close()
+    finally:
+        # SIGTERM makes the service shut down its workers and socket:
+        proc.terminate()
+        proc.wait()
+        proc.stdout.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print(f'Cold start: {1000*cold:8.2f}ms')
+    print(f'Service:    {1000*np.median(warm):8.2f}ms median, '
+          f'{1000*warm.max():.2f}ms max over {nrequest} requests')
+
+    return cold, warm
+
+
+def main(argv=None):
+    '''Command line interface; see `python solver_service.py --help`.'''
+
+    parser = argparse.ArgumentParser(
+        description='Serve CLaSP 410 solvers to local clients.')
+    parser.add_argument('-s', '--socket', default=None,
+                        help='Unix socket path to listen on.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Address to listen on if no socket is given '
+                        '(default: %(default)s)')
+    parser.add_argument('-p', '--port', type=int, default=4100,
+                        help='Port to listen on if no socket is given '
+                        '(default: %(default)s)')
+    parser.add_argument('-n', '--nproc', type=int, default=None,
+                        help='Number of worker processes (default: all CPUs)')
+    args = parser.parse_args(argv)
+
+    asyncio.run(serve(args.socket, args.host, args.port, args.nproc))
+
+
+if __name__ == '__main__':
+    main()